@@ -0,0 +1,217 @@
+"""
+End-to-end benchmark of one start_script cycle against local fake VK, Telegram and Discord servers.
+
+The wall (generated, or a recorded wall.get response with --fixture) is entirely new
+to the bot, so one cycle catches all of it up. Reported:
+  posts/sec, p50/p99 latency from the start of the cycle to the post's last delivery,
+  API calls per post for every service, injected 429s, bytes sent to Telegram and peak RSS of the bot.
+The fake servers run in a subprocess, so the uploads they buffer are not counted in that RSS.
+
+The Discord gateway is not needed: the webhook directory is written in advance and
+every post goes through the fake webhooks.
+
+python benchmarks/bench_e2e.py --posts 300 --tg-latency 0.05 --tg-429 0.02
+python benchmarks/bench_e2e.py --fixture recorded_wall.json --real-limits
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "vktgbot"))
+
+from fake_servers import ServiceOptions, dump_options  # noqa: E402
+from fixtures import make_wall, load_wall  # noqa: E402
+
+DOMAIN = "benchwall"
+SERVER_ID = 1
+TAGS = ("#news", "#music", "#other")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure(args, base_url: str, workdir: str) -> None:
+    # Must run before any module of the bot is imported: config.py reads the environment once
+    os.environ.update(
+        {
+            "VAR_VK_API_URL": f"{base_url}/vk/method",
+            "VAR_VK_TOKEN": "bench",
+            "VAR_VK_DOMAIN": DOMAIN,
+            "VAR_VK_DOMAINS": "[]",
+            "VAR_COMMUNITIES_FILE": "",
+            "VAR_REQ_COUNT": "20",
+            "VAR_REQ_FILTER": "all",
+            "VAR_TG_API_URL": f"{base_url}/tg",
+            "VAR_TG_BOT_TOKEN": "123456:bench",
+            "VAR_TG_CHANNEL": "@bench",
+            "VAR_DISCORDBOT_TOKEN": "bench",
+            "VAR_DISCORDSERVER_ID": str(SERVER_ID if args.discord else 0),
+            "VAR_WEBHOOKS_FILE": os.path.join(workdir, "webhooks.json"),
+            "VAR_STATE_DB": os.path.join(workdir, "state.db"),
+            "VAR_MEDIA_CACHE_DIR": os.path.join(workdir, "media"),
+            "VAR_WHITELIST": "[]",
+            "VAR_BLACKLIST": "[]",
+            "VAR_SKIP_ADS_POSTS": "False",
+            "VAR_SKIP_COPYRIGHTED_POST": "False",
+            "VAR_SKIP_REPOSTS": "False",
+        }
+    )
+    if not args.real_limits:
+        # Measure the pipeline, not the pacing of the production limits
+        os.environ.update(
+            {"VAR_VK_REQUESTS_PER_SECOND": "1000", "VAR_TG_GLOBAL_RATE": "10000", "VAR_TG_CHAT_RATE": "10000", "VAR_TG_CHAT_RATE_PER_MINUTE": "1000000"}
+        )
+    webhooks = {tag: {"channel_id": n + 1, "url": f"{base_url}/discord/api/webhooks/{n + 1}/token"} for n, tag in enumerate(TAGS)}
+    with open(os.environ["VAR_WEBHOOKS_FILE"], "w", encoding="utf-8") as file:
+        json.dump({"server_id": SERVER_ID, "updated_at": time.time() + 10**6, "webhooks": webhooks}, file)
+
+
+async def start_fake_servers(port: int, wall: list, options: dict, args, workdir: str) -> asyncio.subprocess.Process:
+    wall_path, options_path = os.path.join(workdir, "wall.json"), os.path.join(workdir, "options.json")
+    with open(wall_path, "w", encoding="utf-8") as file:
+        json.dump(wall, file)
+    with open(options_path, "w", encoding="utf-8") as file:
+        json.dump(dump_options(options), file)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        os.path.join(BENCH_DIR, "fake_servers.py"),
+        "--port", str(port),
+        "--wall", wall_path,
+        "--options", options_path,
+        "--media-size", str(args.media_size),
+        "--seed", str(args.seed),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    # The servers print one line once they are listening
+    await process.stdout.readline()
+    return process
+
+
+async def fake_stats(base_url: str, clear: bool = False) -> dict:
+    # Counters of the fake servers; a separate session, the bot's one is measured
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.request("DELETE" if clear else "GET", f"{base_url}/stats") as response:
+            return await response.json()
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+async def run(args) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp(prefix="vktgbot-bench-")
+    configure(args, base_url, workdir)
+
+    wall = load_wall(args.fixture, base_url) if args.fixture else make_wall(args.posts, base_url, args.seed)
+    options = {
+        "vk": ServiceOptions(args.vk_latency),
+        "telegram": ServiceOptions(args.tg_latency, args.tg_429, args.retry_after),
+        "discord": ServiceOptions(args.discord_latency, args.discord_429, args.retry_after),
+        "media": ServiceOptions(args.media_latency),
+    }
+    servers = await start_fake_servers(port, wall, options, args, workdir)
+
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+
+    import start_script
+    from http_session import close_session
+    from state_store import state_store
+
+    # Весь фикстурный wall новый для бота
+    state_store.write_cursor(DOMAIN, max(1, min(item["id"] for item in wall) - 1))
+    await fake_stats(base_url, clear=True)
+
+    bot = Bot(token=os.environ["VAR_TG_BOT_TOKEN"], server=TelegramAPIServer.from_base(f"{base_url}/tg"))
+    started_wall = time.time()
+    started = time.perf_counter()
+    try:
+        await start_script.start_script(bot)
+        elapsed = time.perf_counter() - started
+        services = await fake_stats(base_url)
+    finally:
+        await (await bot.get_session()).close()
+        await close_session()
+        servers.terminate()
+        await servers.wait()
+
+    connection = sqlite3.connect(os.environ["VAR_STATE_DB"])
+    rows = connection.execute(
+        "SELECT post_id, MAX(updated_at), MIN(status = 'delivered') FROM deliveries WHERE community = ? GROUP BY post_id",
+        (DOMAIN,),
+    ).fetchall()
+    connection.close()
+    state_store.close()
+
+    latencies = [updated_at - started_wall for _, updated_at, _ in rows]
+    delivered = sum(1 for *_, ok in rows if ok)
+    posts = len(wall)
+    return {
+        "posts": posts,
+        "delivered": delivered,
+        "seconds": round(elapsed, 3),
+        "posts_per_second": round(posts / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p99": round(percentile(latencies, 0.99), 3),
+        "calls_per_post": {service: round(count / posts, 2) for service, count in sorted(services["requests"].items())},
+        "injected_429": services["rate_limited"],
+        "telegram_upload_mb": round(services["bytes_received"].get("telegram", 0) / 1024**2, 2),
+        "discord_files": services["files_received"].get("discord", 0),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=120, help="size of the generated wall")
+    parser.add_argument("--fixture", help="recorded wall.get response (JSON) to replay instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vk-latency", type=float, default=0.02)
+    parser.add_argument("--tg-latency", type=float, default=0.02)
+    parser.add_argument("--discord-latency", type=float, default=0.02)
+    parser.add_argument("--media-latency", type=float, default=0.01)
+    parser.add_argument("--tg-429", type=float, default=0.0, help="share of Telegram requests answered with 429")
+    parser.add_argument("--discord-429", type=float, default=0.0, help="share of webhook requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--media-size", type=int, default=200_000, help="photo size in bytes, documents are 5x")
+    parser.add_argument("--no-discord", dest="discord", action="store_false")
+    parser.add_argument("--real-limits", action="store_true", help="keep the production VK/Telegram pacing")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result))
+        return
+    for key, value in result.items():
+        print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
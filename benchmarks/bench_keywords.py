@@ -0,0 +1,63 @@
+"""
+Benchmark of blacklist/whitelist matching against large word lists.
+
+Compares the compiled KeywordFilter (one Aho–Corasick pass over the text)
+with the old loop that lower-cases and searches every word on every post.
+
+python benchmarks/bench_keywords.py [--words 10 1000 10000] [--chars 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vktgbot"))
+
+from keyword_filter import KeywordFilter  # noqa: E402
+
+ALPHABET = "абвгдежзиклмнопрстуфхцчшэюя"
+
+
+def legacy_matches(words: list, text: str) -> list:
+    text_lower = text.lower()
+    return [word for word in words if word.lower() in text_lower]
+
+
+def make_words(count: int, rng: random.Random) -> list:
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(4, 10))) for _ in range(count)]
+
+
+def make_text(chars: int, rng: random.Random) -> str:
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append("".join(rng.choice(ALPHABET) for _ in range(rng.randint(2, 9))).capitalize())
+    return " ".join(words)[:chars]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--chars", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    text = make_text(args.chars, rng)
+    print(f"{'words':>6} {'compile, ms':>12} {'loop, ms':>9} {'automaton, ms':>14} {'speedup':>8}")
+    for count in args.words:
+        words = make_words(count, rng)
+        compile_time = timeit.timeit(lambda: KeywordFilter(words), number=1)
+        keyword_filter = KeywordFilter(words)
+        assert set(keyword_filter.matches(text)) == set(legacy_matches(words, text))
+        number = 20
+        legacy = min(timeit.repeat(lambda: legacy_matches(words, text), number=number, repeat=args.repeat)) / number
+        compiled = min(timeit.repeat(lambda: keyword_filter.matches(text), number=number, repeat=args.repeat)) / number
+        print(
+            f"{count:>6} {compile_time * 1000:>12.1f} {legacy * 1000:>9.3f} {compiled * 1000:>14.3f} {legacy / compiled:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of the post text renderer on long posts with many mentions.
+
+Compares the single-pass tokenizer (markup.py) with the old chain of passes
+(escape with four str.replace, reformat_vk_links re-searching from the start
+after every replacement, then the regexes of clearTextExcludeLinks for Discord).
+
+python benchmarks/bench_markup.py [--mentions 50 200 1000] [--repeat 5]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vktgbot"))
+
+from markup import parse_markup, render_discord, render_html  # noqa: E402
+
+
+def legacy_render(text: str) -> tuple:
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    match = re.search(r"\[([\w.]+?)\|(.+?)\]", text)
+    while match:
+        left_text = text[: match.span()[0]]
+        right_text = text[match.span()[1] :]
+        matching_text = text[match.span()[0] : match.span()[1]]
+        link_domain, link_text = re.findall(r"\[(.+?)\|(.+?)\]", matching_text)[0]
+        text = left_text + f'<a href="https://vk.com/{link_domain}">{link_text}</a>' + right_text
+        match = re.search(r"\[([\w.]+?)\|(.+?)\]", text)
+
+    markdown_pattern = r"\[([^\]]+)\]\((https?://[^\s]+)\)"
+    markdown_links = re.findall(markdown_pattern, text)
+    text_without_markdown = re.sub(markdown_pattern, "", text)
+    other_links = re.findall(r"https?://[^\s]+", text_without_markdown)
+    discord = "\n".join([f"[{part}]({url})" for part, url in markdown_links] + other_links)
+    return text, discord
+
+
+def single_pass_render(text: str) -> tuple:
+    nodes = parse_markup(text)
+    return render_html(nodes), render_discord(nodes)
+
+
+def make_post(mentions: int) -> str:
+    parts = []
+    for i in range(mentions):
+        parts.append(
+            f"Спасибо [id{i}|Участник {i}] за помощь & поддержку <3, подробнее https://example.com/p/{i}?a=1&b=2 #тег{i % 7}"
+        )
+    return "\n".join(parts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mentions", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mentions':>8} {'chars':>8} {'legacy, ms':>11} {'single pass, ms':>16} {'speedup':>8}")
+    for mentions in args.mentions:
+        text = make_post(mentions)
+        number = max(1, 2000 // mentions)
+        legacy = min(timeit.repeat(lambda: legacy_render(text), number=number, repeat=args.repeat)) / number
+        single = min(timeit.repeat(lambda: single_pass_render(text), number=number, repeat=args.repeat)) / number
+        print(f"{mentions:>8} {len(text):>8} {legacy * 1000:>11.3f} {single * 1000:>16.3f} {legacy / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
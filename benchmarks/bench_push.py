@@ -0,0 +1,237 @@
+"""
+Check and benchmark of push ingest (VAR_INGEST_MODE longpoll and callback) against the local fake VK.
+
+Long poll: the bot connects, catches up on the posts published before it connected,
+then receives new posts as wall_post_new events; the key is expired once to force a
+reconnect, and the community must go back to polling when the task stops.
+Callback: the server must refuse to start without VAR_CALLBACK_SECRET, answer 403 to a wrong
+secret, send only posts that wall.getById confirms, with the text from VK, not from the request, and still
+pick up a post whose event never arrives with its safety poll.
+
+Reported: event-to-delivery latency p50/p99 and the result of every check (exit code 1 if one fails).
+
+python benchmarks/bench_push.py [--posts 20] [--interval 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "vktgbot"))
+
+from bench_e2e import configure, free_port, percentile  # noqa: E402
+from fake_servers import FakeServices, ServiceOptions  # noqa: E402
+from fixtures import OWNER_ID, make_wall  # noqa: E402
+
+DOMAIN = f"club{-OWNER_ID}"
+INITIAL_POSTS = 4
+
+
+class Checks:
+    def __init__(self) -> None:
+        self.results: list = []
+
+    def __call__(self, name: str, ok: bool) -> None:
+        self.results.append((name, ok))
+        print(f"{'ok' if ok else 'FAIL':>5}  {name}")
+
+    @property
+    def passed(self) -> bool:
+        return all(ok for _, ok in self.results)
+
+
+def delivered_at() -> dict:
+    # post_id -> time of the last delivery of the post, only fully delivered posts
+    connection = sqlite3.connect(os.environ["VAR_STATE_DB"])
+    rows = connection.execute(
+        "SELECT post_id, MAX(updated_at), MIN(status = 'delivered') FROM deliveries WHERE community = ? GROUP BY post_id",
+        (DOMAIN,),
+    ).fetchall()
+    connection.close()
+    return {post_id: updated_at for post_id, updated_at, ok in rows if ok}
+
+
+async def wait_delivered(post_ids: list, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        delivered = delivered_at()
+        if all(post_id in delivered for post_id in post_ids):
+            return delivered
+        await asyncio.sleep(0.05)
+    return delivered_at()
+
+
+async def check_long_poll(args, services: FakeServices, posts: list, check: Checks) -> list:
+    import start_script
+    from push_ingest import PushState, run_long_poll
+
+    community = start_script.communities[0]
+    community.group_id = -OWNER_ID
+    state = PushState()
+
+    async def on_post(community, item):
+        await start_script.handle_wall_post(args.bot, community, item)
+
+    async def on_connect(community):
+        return await start_script.catch_up_community(args.bot, community)
+
+    task = asyncio.create_task(run_long_poll(community, state, on_post, on_connect))
+    initial = [item["id"] for item in services.wall]
+    delivered = await wait_delivered(initial, args.timeout)
+    check("long poll: posts published before connecting are caught up", all(post_id in delivered for post_id in initial))
+    check("long poll: community is connected, polling is paused", state.is_connected(community))
+
+    latencies = []
+    half = len(posts) // 2
+    for number, item in enumerate(posts):
+        if number == half:
+            # Новый ключ: клиент получает failed=2 и подключается заново
+            services.expire_long_poll_key()
+        published = time.time()
+        services.publish(item)
+        delivered = await wait_delivered([item["id"]], args.timeout)
+        if item["id"] in delivered:
+            latencies.append(delivered[item["id"]] - published)
+        await asyncio.sleep(args.interval)
+    check(f"long poll: all {len(posts)} new posts are delivered, one key expiry included", len(latencies) == len(posts))
+    check("long poll: reconnected after the key expired", services.vk_methods["groups.getLongPollServer"] == 2)
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    check("long poll: a stopped task hands the community back to polling", not state.is_connected(community))
+    return latencies
+
+
+async def post_event(url: str, payload: dict) -> int:
+    from http_session import get_session
+
+    async with get_session().post(url, json=payload) as response:
+        return response.status
+
+
+async def check_callback(args, services: FakeServices, posts: list, check: Checks) -> list:
+    import config
+    import start_script
+    from push_ingest import PushState, run_callback_server
+
+    community = start_script.communities[0]
+    state = PushState()
+    received: list = []
+
+    async def on_post(community, item):
+        received.append(item)
+        await start_script.handle_wall_post(args.bot, community, item)
+
+    async def on_connect(community):
+        return await start_script.catch_up_community(args.bot, community)
+
+    config.CALLBACK_HOST, config.CALLBACK_PORT, config.CALLBACK_SECRET = "127.0.0.1", free_port(), ""
+    await asyncio.wait_for(run_callback_server([community], state, on_post, on_connect), args.timeout)
+    check("callback: the server does not start without VAR_CALLBACK_SECRET", not state.is_connected(community))
+
+    config.CALLBACK_SECRET = "bench-secret"
+    config.POLL_MAX_INTERVAL = args.safety_poll
+    task = asyncio.create_task(run_callback_server([community], state, on_post, on_connect))
+    url = f"http://127.0.0.1:{config.CALLBACK_PORT}{config.CALLBACK_PATH}"
+    while not state.is_connected(community):
+        await asyncio.sleep(0.01)
+
+    forged = dict(posts[0], id=posts[-1]["id"] + 1000, text="forged")
+    event = {"type": "wall_post_new", "group_id": -OWNER_ID, "object": forged}
+    check("callback: a wrong secret is rejected with 403", await post_event(url, dict(event, secret="wrong")) == 403)
+    await post_event(url, dict(event, secret=config.CALLBACK_SECRET))
+
+    latencies = []
+    for item in posts:
+        services.publish(item)
+        published = time.time()
+        await post_event(url, {**event, "object": dict(item, text="forged"), "secret": config.CALLBACK_SECRET})
+        delivered = await wait_delivered([item["id"]], args.timeout)
+        if item["id"] in delivered:
+            latencies.append(delivered[item["id"]] - published)
+        await asyncio.sleep(args.interval)
+    check(f"callback: all {len(posts)} posts confirmed by wall.getById are delivered", len(latencies) == len(posts))
+    check("callback: a post that is not on the wall is not sent", forged["id"] not in delivered_at())
+    check("callback: text comes from VK, not from the request", received and all(item["text"] != "forged" for item in received))
+
+    # Событие не приходит (callback в VK настроен неверно): пост находит страховочный опрос
+    silent = dict(posts[-1], id=posts[-1]["id"] + 1)
+    services.publish(silent)
+    delivered = await wait_delivered([silent["id"]], args.safety_poll + args.timeout)
+    check("callback: the safety poll delivers a post that got no event", silent["id"] in delivered)
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return latencies
+
+
+async def run(args) -> bool:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp(prefix="vktgbot-push-")
+    configure(SimpleNamespace(discord=False, real_limits=False), base_url, workdir)
+    os.environ.update({"VAR_VK_DOMAIN": DOMAIN, "VAR_VK_GROUP_TOKEN": "bench", "VAR_CALLBACK_CONFIRMATION": "bench"})
+
+    wall = make_wall(INITIAL_POSTS + 2 * args.posts, base_url, kinds=("text", "photo"))
+    oldest_first = list(reversed(wall))
+    initial, long_poll_posts, callback_posts = (
+        oldest_first[:INITIAL_POSTS],
+        oldest_first[INITIAL_POSTS : INITIAL_POSTS + args.posts],
+        oldest_first[INITIAL_POSTS + args.posts :],
+    )
+    services = FakeServices(list(reversed(initial)), {"vk": ServiceOptions(args.vk_latency)})
+    await services.start("127.0.0.1", port)
+
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+
+    from http_session import close_session
+    from state_store import state_store
+
+    # Стена до подключения новая для бота: её догоняет on_connect
+    state_store.write_cursor(DOMAIN, initial[0]["id"] - 1)
+    args.bot = Bot(token=os.environ["VAR_TG_BOT_TOKEN"], server=TelegramAPIServer.from_base(f"{base_url}/tg"))
+    check = Checks()
+    try:
+        long_poll = await check_long_poll(args, services, long_poll_posts, check)
+        callback = await check_callback(args, services, callback_posts, check)
+    finally:
+        await (await args.bot.get_session()).close()
+        await close_session()
+        await services.stop()
+        state_store.close()
+
+    for name, latencies in (("long poll", long_poll), ("callback", callback)):
+        print(
+            f"{name:>10}: event to delivery p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms over {len(latencies)} posts"
+        )
+    return check.passed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=20, help="new posts per mode")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between two new posts")
+    parser.add_argument("--vk-latency", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=15.0, help="seconds to wait for one delivery")
+    parser.add_argument("--safety-poll", type=float, default=1.0, help="VAR_POLL_MAX_INTERVAL in callback mode")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
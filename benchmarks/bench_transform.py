@@ -0,0 +1,116 @@
+"""
+Benchmark of the image recompression stage (media_transform.MediaTransformer).
+
+Generates a fixture set of large noisy photos, fits them under a size limit in the
+process pool and reports images/sec, MB/s, output sizes and the worst event loop lag
+seen while the pool was busy. A second pass measures the content-hash result cache.
+
+python benchmarks/bench_transform.py [--images 8] [--side 4000] [--limit 10485760] [--workers 1 2 4]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "vktgbot"))
+
+
+def make_fixtures(folder: str, count: int, side: int) -> list:
+    # Noise over a gradient compresses badly, like a real high resolution photo
+    from PIL import Image, ImageFilter
+
+    rng = random.Random(42)
+    docs = []
+    for n in range(count):
+        width, height = side, side * 3 // 4
+        noise = Image.effect_noise((width, height), rng.randint(40, 90)).filter(ImageFilter.GaussianBlur(0.6))
+        gradient = Image.linear_gradient("L").resize((width, height))
+        image = Image.merge("RGB", (noise, gradient, Image.eval(noise, lambda value: 255 - value)))
+        extension = "png" if n % 2 else "jpg"
+        path = os.path.join(folder, f"fixture-{n}.{extension}")
+        image.save(path, quality=98) if extension == "jpg" else image.save(path)
+        with open(path, "rb") as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        docs.append({"title": os.path.basename(path), "path": path, "size": os.path.getsize(path), "sha256": sha256})
+    return docs
+
+
+async def measure(transformer, docs: list, limit: int) -> tuple:
+    # A ticker measures how late the event loop wakes up while images are being encoded
+    lag = 0.0
+    running = True
+
+    async def ticker() -> None:
+        nonlocal lag
+        while running:
+            scheduled = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag = max(lag, time.perf_counter() - scheduled - 0.005)
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    results = await transformer.fit_many(docs, limit)
+    elapsed = time.perf_counter() - started
+    running = False
+    await task
+    return results, elapsed, lag
+
+
+async def run(args, docs: list, workdir: str) -> None:
+    from loguru import logger
+
+    from media_transform import MediaTransformer
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    source_mb = sum(doc["size"] for doc in docs) / 2**20
+    print(f"{len(docs)} images, {source_mb:.1f} MB, limit {args.limit / 2**20:.1f} MB")
+    print(f"{'workers':>7} {'pass':>6} {'seconds':>8} {'images/s':>9} {'MB/s':>7} {'max lag, ms':>12} {'out, MB':>8}")
+    for workers in args.workers:
+        transformer = MediaTransformer(os.path.join(workdir, f"out-{workers}"), workers, args.quality, 10**12)
+        try:
+            # Start the worker processes outside of the measurement
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(transformer.executor, time.sleep, 0.2) for _ in range(workers)))
+            for label in ("cold", "cached"):
+                results, elapsed, lag = await measure(transformer, docs, args.limit)
+                assert len(results) == len(docs) and all(doc["size"] <= args.limit for doc in results)
+                print(
+                    f"{workers:>7} {label:>6} {elapsed:>8.2f} {len(docs) / elapsed:>9.2f} {source_mb / elapsed:>7.1f} "
+                    f"{lag * 1000:>12.1f} {sum(doc['size'] for doc in results) / 2**20:>8.1f}"
+                )
+        finally:
+            transformer.shutdown()
+    print(f"{os.cpu_count()} CPUs available")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--side", type=int, default=4000, help="width of the fixtures in pixels")
+    parser.add_argument("--limit", type=int, default=2**20 * 10, help="target size in bytes (Discord upload limit)")
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        sys.exit("Pillow is not installed: pip install Pillow")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # config.py reads the environment once, keep the media cache of the bot untouched
+        os.environ["VAR_MEDIA_CACHE_DIR"] = os.path.join(workdir, "media")
+        docs = make_fixtures(workdir, args.images, args.side)
+        asyncio.run(run(args, docs, workdir))
+
+
+if __name__ == "__main__":
+    main()
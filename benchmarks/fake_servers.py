@@ -0,0 +1,274 @@
+"""
+Local stand-ins for the VK API, the Telegram Bot API and Discord webhooks.
+
+One aiohttp application serves all of them under different prefixes:
+  /vk/method/<name>                     wall.get (replays the fixture wall), wall.getById, execute, groups.getById,
+                                        video.get, groups.getLongPollServer
+  /vk/longpoll                          Bots Long Poll a_check, publish() pushes wall_post_new events
+  /tg/bot<token>/<method>               any Bot API method, answers like Telegram
+  /discord/api/webhooks/<id>/<token>    webhook executions
+  /media/<name>                         photos and documents referenced by the fixtures
+  /stats                                the counters below as JSON (DELETE clears the request counters)
+
+Every service has its own latency and 429 probability; requests and 429s are counted per service.
+
+Run standalone, so that the memory of the servers does not count towards the bot's process:
+python benchmarks/fake_servers.py --port 8000 --wall wall.json --options options.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+
+from aiohttp import web
+
+
+@dataclass
+class ServiceOptions:
+    latency: float = 0.0  # seconds added to every response
+    rate_limit_probability: float = 0.0  # share of requests answered with 429
+    retry_after: float = 1.0
+
+
+class FakeServices:
+    def __init__(self, wall: list, options: dict, media_size: int = 200_000, seed: int = 0) -> None:
+        self.wall = wall  # newest post first, as wall.get returns it
+        self.options = options  # service name -> ServiceOptions
+        self.media_size = media_size
+        self.random = random.Random(seed)
+        self.requests: Counter = Counter()
+        self.vk_methods: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        self.bytes_received: Counter = Counter()
+        self.files_received: Counter = Counter()
+        self.message_id = 0
+        self.started = time.monotonic()
+        self.long_poll_key = "key1"
+        self.long_poll_updates: list = []  # every event ever published, ts is the index after it
+        self._long_poll_event = asyncio.Event()
+
+        self.app = web.Application(client_max_size=1024**3)
+        self.app.router.add_route("*", "/vk/method/{name}", self.vk_method)
+        self.app.router.add_get("/vk/longpoll", self.long_poll)
+        self.app.router.add_post("/tg/bot{token}/{method}", self.telegram_method)
+        self.app.router.add_post("/discord/api/webhooks/{id}/{token}", self.discord_webhook)
+        self.app.router.add_get("/media/{name}", self.media)
+        self.app.router.add_get("/stats", self.stats)
+        self.app.router.add_delete("/stats", self.clear_stats)
+        self._runner = None
+
+    async def start(self, host: str, port: int) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _enter(self, service: str) -> bool:
+        # Counts the request, waits the service latency; True if this request gets a 429
+        self.requests[service] += 1
+        options = self.options.get(service, ServiceOptions())
+        if options.latency:
+            await asyncio.sleep(options.latency)
+        if options.rate_limit_probability and self.random.random() < options.rate_limit_probability:
+            self.rate_limited[service] += 1
+            return True
+        return False
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "bytes_received": self.bytes_received,
+                "files_received": self.files_received,
+                "vk_methods": self.vk_methods,
+            }
+        )
+
+    async def clear_stats(self, request: web.Request) -> web.Response:
+        self.requests.clear()
+        self.vk_methods.clear()
+        return web.json_response({})
+
+    # VK
+
+    async def vk_method(self, request: web.Request) -> web.Response:
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        if await self._enter("vk"):
+            return web.json_response({"error": {"error_code": 6, "error_msg": "Too many requests per second"}})
+
+        name = request.match_info["name"]
+        self.vk_methods[name] += 1
+        if name == "wall.get":
+            offset, count = int(params.get("offset", 0)), int(params.get("count", 20))
+            return web.json_response({"response": {"count": len(self.wall), "items": self.wall[offset : offset + count]}})
+        if name == "wall.getById":
+            ids = set(filter(None, params.get("posts", "").split(",")))
+            return web.json_response({"response": [item for item in self.wall if f"{item['owner_id']}_{item['id']}" in ids]})
+        if name == "groups.getLongPollServer":
+            server = f"{request.scheme}://{request.host}/vk/longpoll"
+            return web.json_response({"response": {"key": self.long_poll_key, "server": server, "ts": str(len(self.long_poll_updates))}})
+        if name == "execute":
+            return web.json_response({"response": [self._execute_call(call) for call in re.findall(r"API\.[^;]+?\}\)", params.get("code", ""))]})
+        if name == "groups.getById":
+            return web.json_response({"response": {"groups": self._groups(params.get("group_ids", ""))}})
+        if name == "video.get":
+            return web.json_response({"response": {"items": self._videos(params.get("videos", ""))}})
+        return web.json_response({"error": {"error_code": 3, "error_msg": f"Unknown method passed: {name}"}})
+
+    def publish(self, item: dict) -> None:
+        # A new post: on the wall for wall.get/wall.getById and a wall_post_new event for long poll clients
+        self.wall.insert(0, item)
+        self.long_poll_updates.append({"type": "wall_post_new", "object": item, "group_id": -item["owner_id"]})
+        self._long_poll_event.set()
+        self._long_poll_event = asyncio.Event()
+
+    def expire_long_poll_key(self) -> None:
+        # Clients get failed=2 and have to call groups.getLongPollServer again
+        self.long_poll_key = f"key{len(self.long_poll_updates) + 2}"
+        self._long_poll_event.set()
+        self._long_poll_event = asyncio.Event()
+
+    async def long_poll(self, request: web.Request) -> web.Response:
+        await self._enter("vk_long_poll")
+        if request.query.get("key") != self.long_poll_key:
+            return web.json_response({"failed": 2})
+        ts = int(request.query.get("ts", 0))
+        if ts >= len(self.long_poll_updates):
+            try:
+                await asyncio.wait_for(self._long_poll_event.wait(), float(request.query.get("wait", 25)))
+            except asyncio.TimeoutError:
+                pass
+        if request.query.get("key") != self.long_poll_key:
+            return web.json_response({"failed": 2})
+        return web.json_response({"ts": str(len(self.long_poll_updates)), "updates": self.long_poll_updates[ts:]})
+
+    def _execute_call(self, call: str):
+        values = json.loads(call[call.index("(") + 1 : -1])
+        if call.startswith("API.video.get"):
+            return {"items": self._videos(values["videos"])}
+        return {"groups": self._groups(values["group_ids"])}
+
+    @staticmethod
+    def _videos(keys: str) -> list:
+        videos = []
+        for key in filter(None, keys.split(",")):
+            owner_id, video_id = key.split("_")[:2]
+            videos.append(
+                {"owner_id": int(owner_id), "id": int(video_id), "files": {"external": f"https://youtu.be/{owner_id}{video_id}"}}
+            )
+        return videos
+
+    @staticmethod
+    def _groups(ids: str) -> list:
+        return [{"id": int(group_id), "name": f"Group {group_id}", "screen_name": f"club{group_id}"} for group_id in filter(None, ids.split(","))]
+
+    # Telegram
+
+    async def telegram_method(self, request: web.Request) -> web.Response:
+        self.bytes_received["telegram"] += len(await request.read())
+        method = request.match_info["method"].lower()
+        options = self.options.get("telegram", ServiceOptions())
+        if await self._enter("telegram"):
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {options.retry_after:g}",
+                    "parameters": {"retry_after": options.retry_after},
+                },
+                status=429,
+            )
+        if method == "sendmediagroup":
+            return web.json_response({"ok": True, "result": [self._message("photo") for _ in range(2)]})
+        kind = {"sendphoto": "photo", "senddocument": "document"}.get(method)
+        return web.json_response({"ok": True, "result": self._message(kind)})
+
+    def _message(self, kind: str = None) -> dict:
+        self.message_id += 1
+        message = {"message_id": self.message_id, "date": int(time.time()), "chat": {"id": -1001, "type": "channel"}}
+        file = {"file_id": f"file{self.message_id}", "file_unique_id": f"unique{self.message_id}"}
+        if kind == "photo":
+            message["photo"] = [dict(file, width=1280, height=720)]
+        elif kind == "document":
+            message["document"] = file
+        return message
+
+    # Discord
+
+    async def discord_webhook(self, request: web.Request) -> web.Response:
+        # Like Discord: files[n] fields with the matching payload_json "attachments", at most 10 per message
+        files = 0
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                self.bytes_received["discord"] += len(await part.read())
+                files += part.name.startswith("files[")
+        if files > 10:
+            return web.json_response({"message": "Maximum number of attachments exceeded", "code": 50035}, status=400)
+        self.files_received["discord"] += files
+        options = self.options.get("discord", ServiceOptions())
+        if await self._enter("discord"):
+            return web.json_response(
+                {"message": "You are being rate limited.", "retry_after": options.retry_after, "global": False},
+                status=429,
+                headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": str(options.retry_after)},
+            )
+        return web.json_response({"id": "1"}, headers={"X-RateLimit-Remaining": "4", "X-RateLimit-Reset-After": "1"})
+
+    # Media
+
+    async def media(self, request: web.Request) -> web.Response:
+        await self._enter("media")
+        name = request.match_info["name"]
+        size = self.media_size * (5 if name.startswith("doc") else 1)
+        body = (name.encode() * (size // max(1, len(name)) + 1))[:size]
+        return web.Response(body=body, content_type="application/octet-stream")
+
+
+async def serve(host: str, port: int, wall: list, options: dict, media_size: int, seed: int) -> None:
+    services = FakeServices(wall, options, media_size, seed)
+    await services.start(host, port)
+    print(f"listening on {host}:{port}", flush=True)
+    await asyncio.Event().wait()
+
+
+def dump_options(options: dict) -> dict:
+    # ServiceOptions as JSON for --options
+    return {service: asdict(values) for service, values in options.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local fake VK, Telegram and Discord servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--wall", required=True, help="JSON list of posts, newest first")
+    parser.add_argument("--options", help='JSON {"service": {"latency": ..., "rate_limit_probability": ..., "retry_after": ...}}')
+    parser.add_argument("--media-size", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.wall, "r", encoding="utf-8") as file:
+        wall = json.load(file)
+    options = {}
+    if args.options:
+        with open(args.options, "r", encoding="utf-8") as file:
+            options = {service: ServiceOptions(**values) for service, values in json.load(file).items()}
+    try:
+        asyncio.run(serve(args.host, args.port, wall, options, args.media_size, args.seed))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
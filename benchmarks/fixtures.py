@@ -0,0 +1,105 @@
+"""
+wall.get fixtures for the end-to-end benchmark.
+
+make_wall() builds a deterministic wall mixing text-only posts, single photos,
+photo albums, documents, reposts and long texts. load_wall() replays a recorded
+wall.get response instead; its photo and document urls are pointed at the local
+media server so nothing leaves the machine.
+"""
+
+import hashlib
+import json
+import random
+
+KINDS = ("text", "photo", "album", "doc", "repost", "long")
+OWNER_ID = -1000
+FIRST_POST_ID = 1001  # the benchmark sets the cursor just below the wall, and cursor 0 means "no cursor"
+
+WORDS = (
+    "новости обновление релиз концерт билеты сегодня завтра встреча фото видео "
+    "подробности ссылка участники команда проект музыка"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    text = []
+    for i in range(words):
+        word = rng.choice(WORDS)
+        if i and i % 12 == 0:
+            word += "."
+        if rng.random() < 0.02:
+            word = f"[id{rng.randint(1, 10**6)}|{word.capitalize()}]"
+        text.append(word)
+    return " ".join(text).capitalize() + "."
+
+
+def _photo(base_url: str, name: str) -> dict:
+    return {"type": "photo", "photo": {"sizes": [{"type": "x", "url": f"{base_url}/media/{name}.jpg"}]}}
+
+
+def _doc(base_url: str, name: str, size: int) -> dict:
+    return {"type": "doc", "doc": {"url": f"{base_url}/media/{name}.pdf", "title": f"{name}.pdf", "size": size}}
+
+
+def make_wall(posts: int, base_url: str, seed: int = 0, kinds: tuple = KINDS, doc_size: int = 1_000_000) -> list:
+    rng = random.Random(seed)
+    items = []
+    for number in range(posts):
+        post_id = FIRST_POST_ID + number
+        kind = kinds[number % len(kinds)]
+        tag = rng.choice(["#news", "#music", "#other", ""])
+        item = {
+            "id": post_id,
+            "owner_id": OWNER_ID,
+            "from_id": OWNER_ID,
+            "date": 1700000000 + post_id * 60,
+            "post_type": "post",
+            "marked_as_ads": 0,
+            "text": f"{_text(rng, rng.randint(10, 60))} {tag}".strip(),
+            "attachments": [],
+        }
+        if kind == "photo":
+            item["attachments"].append(_photo(base_url, f"photo_{post_id}"))
+        elif kind == "album":
+            item["attachments"] += [_photo(base_url, f"photo_{post_id}_{n}") for n in range(4)]
+        elif kind == "doc":
+            item["attachments"].append(_doc(base_url, f"doc_{post_id}", doc_size))
+        elif kind == "repost":
+            group_id = rng.randint(1, 50)
+            item["copy_history"] = [
+                {
+                    "id": post_id * 10,
+                    "owner_id": -group_id,
+                    "from_id": -group_id,
+                    "text": _text(rng, 30),
+                    "attachments": [{"type": "video", "video": {"owner_id": -group_id, "id": post_id, "type": "video"}}],
+                }
+            ]
+        elif kind == "long":
+            item["text"] = "\n\n".join(_text(rng, 150) for _ in range(8))
+            item["attachments"].append(_photo(base_url, f"photo_{post_id}"))
+        items.append(item)
+    return list(reversed(items))
+
+
+def load_wall(path: str, base_url: str) -> list:
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    data = data.get("response", data)
+    items = data["items"] if isinstance(data, dict) else data
+    for item in items:
+        for part in [item] + item.get("copy_history", []):
+            for attachment in part.get("attachments", []):
+                _localize(attachment, base_url)
+    return sorted(items, key=lambda item: item["id"], reverse=True)
+
+
+def _localize(attachment: dict, base_url: str) -> None:
+    def local(url: str, prefix: str) -> str:
+        return f"{base_url}/media/{prefix}_{hashlib.sha1(url.encode()).hexdigest()[:12]}"
+
+    if attachment["type"] == "photo":
+        for size in attachment["photo"].get("sizes", []):
+            size["url"] = local(size["url"], "photo") + ".jpg"
+    elif attachment["type"] == "doc":
+        attachment["doc"]["url"] = local(attachment["doc"]["url"], "doc")
@@ -6,13 +6,25 @@ v1.0
 by @stixanna
 """
 
-import time
+import argparse
+import asyncio
+from contextlib import nullcontext
 
+from aiogram import Bot
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 from loguru import logger
 
-from config import SINGLE_START, TIME_TO_SLEEP
-from start_script import start_script
-from tools import prepare_temp_folder
+import config
+from backfill import run_backfill
+from discord_service import stop_discord_service
+from http_session import close_session
+from media_transform import media_transformer
+from metrics import start_metrics_server
+from poll_scheduler import PollScheduler
+from profiler import CycleProfiler
+from push_ingest import PushState, run_push
+from start_script import catch_up_community, communities, handle_wall_post, start_script
+from state_store import state_store
 
 # Лог для всех сообщений DEBUG и выше
 logger.add(
@@ -31,25 +43,113 @@ logger.add(
 )
 
 
-logger.info("Script is started.")
+parser = argparse.ArgumentParser(prog="vktgbot")
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    default=config.PROFILE,
+    help="write cProfile stats and a tracemalloc report of every cycle to VAR_PROFILE_DIR",
+)
+parser.add_argument(
+    "--backfill",
+    nargs="*",
+    metavar="DOMAIN",
+    help="mirror the whole wall history oldest-first (of the given communities or of all of them) and exit",
+)
+
+
+@logger.catch
+async def main(bot: Bot, selected: list = None):
+    return await start_script(bot, selected)
 
 
 @logger.catch
-def main(firstStartBool):
-    start_script(firstStartBool)
-    prepare_temp_folder()
+async def run_push_ingest(bot: Bot, push_state: PushState):
+    async def on_post(community, item):
+        await handle_wall_post(bot, community, item)
 
-firstStartBool = True
-while True:
+    async def on_connect(community):
+        return await catch_up_community(bot, community)
+
+    await run_push(communities, push_state, logger.catch(on_post), logger.catch(on_connect))
+
+
+@logger.catch
+async def backfill(bot: Bot):
+    selected = [c for c in communities if not args.backfill or c.domain in args.backfill]
+    unknown = set(args.backfill) - {c.domain for c in communities}
+    if unknown:
+        logger.error(f"Unknown communities to backfill: {', '.join(sorted(unknown))}")
+    return await run_backfill(bot, selected)
+
+
+async def poll_forever(bot: Bot):
+    push_state = PushState()
+    profiler = None
+    if args.profile:
+        profiler = CycleProfiler(config.PROFILE_DIR, config.PROFILE_KEEP, config.PROFILE_TOP, config.PROFILE_FRAMES)
+        profiler.start()
+    push_task = None
+    if config.INGEST_MODE in ("longpoll", "callback") and not config.SINGLE_START:
+        logger.info(f"Ingest mode: {config.INGEST_MODE}, polling covers communities without a push channel.")
+        push_task = asyncio.create_task(run_push_ingest(bot, push_state))
+    scheduler = PollScheduler(
+        config.TIME_TO_SLEEP,
+        config.POLL_MIN_INTERVAL,
+        config.POLL_MAX_INTERVAL,
+        config.POLL_JITTER,
+        len(communities),
+        config.VK_REQUESTS_PER_SECOND,
+    )
+    try:
+        while True:
+            # Сообщества с живым push-каналом не опрашиваются
+            polled = [c for c in communities if not push_state.is_connected(c)]
+            due = scheduler.due(polled)
+            if due:
+                async with profiler.profile() if profiler else nullcontext():
+                    results = await main(bot, due) or {}
+                for community in due:
+                    scheduler.record(community, results.get(community.domain))
+            if config.SINGLE_START:
+                logger.info("Script has successfully completed its execution")
+                return
+            delay = scheduler.seconds_until_next(polled)
+            if push_task is not None:
+                # Просыпаемся не реже min_interval: сообщество могло потерять push-канал
+                delay = min(delay, scheduler.min_interval)
+            logger.info(f"Script went to sleep for {delay:.0f} seconds.")
+            await asyncio.sleep(delay)
+    finally:
+        if push_task is not None:
+            push_task.cancel()
+
+
+# Один цикл событий, одна сессия бота Telegram и один пул HTTP-соединений на весь процесс
+async def run_forever():
+    server = TelegramAPIServer.from_base(config.TG_API_URL) if config.TG_API_URL else TELEGRAM_PRODUCTION
+    bot = Bot(token=config.TG_BOT_TOKEN, server=server)
+    metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT) if config.METRICS_PORT else None
     try:
-        main(firstStartBool)
-        firstStartBool = False
-        if SINGLE_START:
-            logger.info("Script has successfully completed its execution")
-            exit()
+        if args.backfill is not None:
+            await backfill(bot)
         else:
-            logger.info(f"Script went to sleep for {TIME_TO_SLEEP} seconds.")
-            time.sleep(TIME_TO_SLEEP)
+            await poll_forever(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await stop_discord_service()
+        await (await bot.get_session()).close()
+        await close_session()
+        media_transformer.shutdown()
+        state_store.close()
+
+
+# Процессы пула media_transform (spawn) не должны запускать бота заново
+if __name__ == "__main__":
+    args = parser.parse_args()
+    logger.info("Script is started.")
+    try:
+        asyncio.run(run_forever())
     except KeyboardInterrupt:
         logger.info("Script is stopped by the user.")
-        exit()
@@ -1,70 +1,208 @@
+import asyncio
+import re
+import time
 from typing import Union
 
-import re
-import requests
+import aiohttp
 from loguru import logger
 
+from config import VK_API_URL, VK_REQUESTS_PER_SECOND
+from http_session import get_session
+from metrics import flood_waits, stage_seconds
+
+
+class RateLimiter:
+    # VK allows a limited number of requests per second for one token.
+    # Every caller reserves the next free slot, so concurrent requests are spread evenly.
+
+    def __init__(self, requests_per_second: float) -> None:
+        self.interval = 1 / requests_per_second
+        self._next_slot = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+vk_rate_limiter = RateLimiter(VK_REQUESTS_PER_SECOND)
+
 
-def get_data_from_vk(
-    vk_token: str, req_version: float, vk_domain: str, req_filter: str, req_count: int
+# Returns the wall.get response: {"count": posts on the wall, "items": [...]}
+async def get_data_from_vk(
+    vk_token: str, req_version: float, vk_domain: str, req_filter: str, req_count: int, offset: int = 0
 ) -> Union[dict, None]:
-    logger.info("Trying to get posts from VK.")
+    logger.info(f"Trying to get posts from VK: {vk_domain} (offset {offset}).")
 
-    match = re.search("^(club|public)(\d+)$", vk_domain)
+    match = re.search(r"^(club|public)(\d+)$", vk_domain)
     if match:
         source_param = {"owner_id": "-" + match.groups()[1]}
     else:
         source_param = {"domain": vk_domain}
 
-    response = requests.get(
-        "https://api.vk.com/method/wall.get",
+    await vk_rate_limiter.wait()
+    try:
+        with stage_seconds.time("fetch"):
+            data = await _wall_get(vk_token, req_version, req_filter, req_count, offset, source_param)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.error(f"Error was detected when requesting data from VK ({vk_domain}): {ex!r}")
+        return None
+
+    if "response" in data:
+        return data["response"]
+    elif "error" in data:
+        if data["error"].get("error_code") == 6:  # too many requests per second
+            flood_waits.inc("vk")
+        logger.error(f"Error was detected when requesting data from VK ({vk_domain}): {data['error']['error_msg']}")
+    return None
+
+
+async def _wall_get(vk_token: str, req_version: float, req_filter: str, req_count: int, offset: int, source_param: dict) -> dict:
+    async with get_session().get(
+        f"{VK_API_URL}/wall.get",
         params=dict(
             {
                 "access_token": vk_token,
                 "v": req_version,
                 "filter": req_filter,
                 "count": req_count,
+                "offset": offset,
             },
             **source_param,
         ),
+    ) as response:
+        return await response.json(content_type=None)
+
+
+async def get_data_from_vk_many(vk_token: str, req_version: float, communities: list) -> dict:
+    # Все сообщества опрашиваются одновременно, лимит запросов держит vk_rate_limiter
+    results = await asyncio.gather(
+        *(
+            get_data_from_vk(vk_token, req_version, community.domain, community.req_filter, community.req_count)
+            for community in communities
+        )
     )
-    data = response.json()
-    if "response" in data:
-        return data["response"]["items"]
-    elif "error" in data:
-        logger.error("Error was detected when requesting data from VK: " f"{data['error']['error_msg']}")
-    return None
+    return {community.domain: page for community, page in zip(communities, results)}
 
 
-def get_video_url(vk_token: str, req_version: float, owner_id: str, video_id: str, access_key: str) -> str:
-    response = requests.get(
-        "https://api.vk.com/method/video.get",
-        params={
-            "access_token": vk_token,
-            "v": req_version,
-            "videos": f"{owner_id}_{video_id}{'' if not access_key else f'_{access_key}'}",
-        },
+async def get_wall_posts(vk_token: str, req_version: float, group_id: int, post_ids: list) -> Union[list, None]:
+    # wall.getById for the posts of one community, None if VK answered with an error
+    response = await call_vk_method(
+        vk_token, req_version, "wall.getById", posts=",".join(f"-{group_id}_{post_id}" for post_id in post_ids)
     )
-    data = response.json()
-    if "response" in data and data["response"]["items"]:
-        return data["response"]["items"][0]["files"].get("external", "")
+    if response is None:
+        return None
+    # Since API 5.187 wall.getById returns {"items": [...]}
+    return response.get("items", []) if isinstance(response, dict) else response
+
+
+def get_newest_post_id(page: dict) -> Union[int, None]:
+    ids = [item["id"] for item in page["items"] if not item.get("is_pinned")]
+    return max(ids) if ids else None
+
+
+async def iter_new_posts(
+    vk_token: str,
+    req_version: float,
+    community,
+    last_known_id: int,
+    first_page: Union[dict, None] = None,
+    page_size: int = 100,
+):
+    # Yields posts newer than last_known_id oldest-first, however many were published.
+    # Only one page is held in memory; offsets count from the newest post, as in wall.get.
+    # The pinned post is skipped, like it always was.
+
+    # 1. Page backwards until the newest already known post to find where the new ones end
+    offset = 0
+    page = first_page
+    boundary = None  # offset of the newest known post (or of the end of the wall)
+    while boundary is None:
+        if page is None:
+            page = await get_data_from_vk(
+                vk_token, req_version, community.domain, community.req_filter, page_size, offset
+            )
+            if page is None:
+                return
+        items = page["items"]
+        for index, item in enumerate(items):
+            if not item.get("is_pinned") and item["id"] <= last_known_id:
+                boundary = offset + index
+                break
+        else:
+            if not items or offset + len(items) >= page["count"]:
+                boundary = offset + len(items)
+            else:
+                offset += len(items)
+                page = None
+
+    if offset == 0:
+        # Usual case: everything new is already in the first page
+        new_items = [item for item in page["items"][:boundary] if not item.get("is_pinned")]
+        for item in sorted(new_items, key=lambda item: item["id"]):
+            yield item
+        return
+
+    # 2. Walk back to the newest post in windows that overlap by one post.
+    # If the oldest post of a window is not known yet, new posts have shifted the wall,
+    # so the window moves further back instead of leaving a gap.
+    page = None
+    logger.info(f"{community.domain}: catching up on about {boundary} posts.")
+    end = boundary
+    last_yielded = last_known_id
+    while end > 0:
+        start = max(0, end - page_size + 1)
+        count = end - start + 1
+        page = await get_data_from_vk(vk_token, req_version, community.domain, community.req_filter, count, start)
+        if page is None:
+            return
+        regular = [item for item in page["items"] if not item.get("is_pinned")]
+        reached_end = len(page["items"]) < count
+        if regular and min(item["id"] for item in regular) > last_yielded and not reached_end:
+            end += count - 1
+            continue
+        for item in sorted((item for item in regular if item["id"] > last_yielded), key=lambda item: item["id"]):
+            yield item
+            last_yielded = item["id"]
+        end = start
+
+
+async def execute_vk_code(vk_token: str, req_version: float, code: str) -> Union[dict, list, None]:
+    # VK "execute" runs up to 25 API calls in a single HTTP request
+    await vk_rate_limiter.wait()
+    try:
+        async with get_session().post(
+            f"{VK_API_URL}/execute",
+            data={"access_token": vk_token, "v": req_version, "code": code},
+        ) as response:
+            data = await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.error(f"Error was detected when requesting VK execute: {ex!r}")
+        return None
+    if "execute_errors" in data:
+        for error in data["execute_errors"]:
+            logger.warning(f"Error was detected in VK execute ({error['method']}): {error['error_msg']}")
+    if "response" in data:
+        return data["response"]
     elif "error" in data:
         logger.error(f"Error was detected when requesting data from VK: {data['error']['error_msg']}")
-    return ""
+    return None
 
 
-def get_group_name(vk_token: str, req_version: float, owner_id) -> str:
-    response = requests.get(
-        "https://api.vk.com/method/groups.getById",
-        params={
-            "access_token": vk_token,
-            "v": req_version,
-            "group_id": owner_id,
-        },
-    )
-    data = response.json()
+async def call_vk_method(vk_token: str, req_version: float, method: str, **params) -> Union[dict, list, None]:
+    await vk_rate_limiter.wait()
+    try:
+        async with get_session().post(
+            f"{VK_API_URL}/{method}", data=dict({"access_token": vk_token, "v": req_version}, **params)
+        ) as response:
+            data = await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.error(f"Error was detected when requesting {method} from VK: {ex!r}")
+        return None
     if "response" in data:
-        return data["response"][0]["name"]
+        return data["response"]
     elif "error" in data:
-        logger.error(f"Error was detected when requesting data from VK: {data['error']['error_msg']}")
-    return ""
+        logger.error(f"Error was detected when requesting {method} from VK: {data['error']['error_msg']}")
+    return None
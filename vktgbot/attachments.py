@@ -0,0 +1,40 @@
+from dataclasses import dataclass
+
+# Attachment handles produced by parse_post without touching the network.
+# Video urls and documents are resolved later, for many posts at once.
+
+
+@dataclass(frozen=True)
+class Photo:
+    url: str  # the biggest size, already picked
+
+
+@dataclass(frozen=True)
+class VideoRef:
+    owner_id: int
+    id: int
+    type: str = "video"
+    access_key: str = ""
+
+    @property
+    def key(self) -> str:
+        return f"{self.owner_id}_{self.id}"
+
+    @property
+    def fallback_url(self) -> str:
+        # Ссылка на сам VK, если внешней ссылки у видео нет
+        if self.type == "short_video":
+            return f"https://vk.com/clip{self.owner_id}_{self.id}"
+        return f"https://vk.com/video{self.owner_id}_{self.id}"
+
+
+@dataclass(frozen=True)
+class DocRef:
+    url: str
+    size: int = 0
+    ext: str = ""
+
+
+@dataclass(frozen=True)
+class Link:
+    url: str
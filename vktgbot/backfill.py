@@ -0,0 +1,144 @@
+import asyncio
+import time
+from typing import Union
+
+from aiogram import Bot
+from loguru import logger
+
+import config
+from api_requests import get_data_from_vk
+from communities import Community
+from start_script import send_chunk
+from state_store import state_store
+
+PAGE_SIZE = 100  # wall.get maximum
+
+
+class BackfillProgress:
+    # Throughput and ETA of one community, logged at most every `interval` seconds
+
+    def __init__(self, domain: str, processed: int, interval: float) -> None:
+        self.domain = domain
+        self.interval = interval
+        self.initial = processed
+        self.processed = processed
+        self.total = 0
+        self.position = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def update(self, processed: int, position: int, total: int) -> None:
+        self.processed, self.position, self.total = processed, position, total
+        if time.monotonic() - self._reported >= self.interval:
+            self.report()
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return (self.processed - self.initial) / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> None:
+        self._reported = time.monotonic()
+        rate = self.rate()
+        remaining = max(0, self.total - self.position)
+        eta = time.strftime("%H:%M:%S", time.gmtime(remaining / rate)) if rate else "unknown"
+        logger.info(
+            f"{self.domain}: backfill {self.processed} posts processed, about {remaining} left "
+            f"of {self.total}, {rate * 60:.1f} posts/min, ETA {eta}."
+        )
+
+
+def window(total: int, position: int, page_size: int = PAGE_SIZE) -> tuple:
+    # wall.get offsets count from the newest post; `position` posts from the oldest one are passed.
+    # The window takes the next posts up the wall plus the newest passed one to detect shifts.
+    end = total - position
+    overlap = 1 if position else 0
+    start = max(0, end - page_size + overlap)
+    return start, end - start + overlap
+
+
+async def fetch_window(community: Community, start: int, count: int) -> Union[dict, None]:
+    return await get_data_from_vk(config.VK_TOKEN, config.REQ_VERSION, community.domain, community.req_filter, count, start)
+
+
+async def backfill_community(bot: Bot, community: Community) -> bool:
+    # Mirrors the whole wall oldest-first, up to the cursor of the live mode if it has one.
+    # Returns True when the community is fully backfilled; an interrupted run resumes from the checkpoint.
+    checkpoint = state_store.read_backfill(community.domain)
+    if checkpoint["finished"]:
+        logger.info(f"{community.domain}: backfill is already finished.")
+        return True
+    live_cursor = state_store.read_cursor(community.domain)
+    last_id, position, processed = checkpoint["last_id"], checkpoint["position"], checkpoint["processed"]
+    if last_id:
+        logger.info(f"{community.domain}: resuming backfill after post {last_id} ({processed} posts processed).")
+
+    first = await fetch_window(community, 0, 1)
+    if first is None:
+        return False
+    total = first["count"]
+    progress = BackfillProgress(community.domain, processed, config.BACKFILL_REPORT_INTERVAL)
+    prefetched: Union[asyncio.Task, None] = None
+
+    def on_processed(post_id: int) -> None:
+        nonlocal last_id, processed
+        last_id = post_id
+        processed += 1
+        state_store.write_backfill(community.domain, last_id, position, processed)
+        progress.update(processed, position, total)
+
+    try:
+        while position < total:
+            start, count = window(total, position)
+            if prefetched is not None and prefetched.get_name() == f"{start}:{count}":
+                page = await prefetched
+            else:
+                page = await fetch_window(community, start, count)
+            prefetched = None
+            if page is None:
+                logger.error(f"{community.domain}: backfill is interrupted, it will resume from post {last_id}.")
+                return False
+            if page["count"] != total:
+                # Посты добавились или удалились, смещения сдвинулись: окно пересчитывается
+                total = page["count"]
+                continue
+            regular = [item for item in page["items"] if not item.get("is_pinned")]
+            if position and regular and min(item["id"] for item in regular) > last_id:
+                # Под окном удалили посты и пройденный пост не попал в него: окно сдвигается к старым
+                position = max(0, position - (count - 1))
+                continue
+
+            reached_live = live_cursor is not None and any(item["id"] >= live_cursor for item in regular)
+            items = sorted(
+                (item for item in regular if item["id"] > last_id and (live_cursor is None or item["id"] <= live_cursor)),
+                key=lambda item: item["id"],
+            )
+            next_position = total - start
+            if next_position < total and not reached_live:
+                # Следующая страница загружается, пока отправляется текущая
+                next_start, next_count = window(total, next_position)
+                prefetched = asyncio.create_task(
+                    fetch_window(community, next_start, next_count), name=f"{next_start}:{next_count}"
+                )
+
+            await send_chunk(bot, community, items, config.BACKFILL_CONCURRENCY, on_processed)
+            position = next_position
+            state_store.write_backfill(community.domain, last_id, position, processed)
+            progress.update(processed, position, total)
+            if reached_live:
+                break
+    finally:
+        if prefetched is not None:
+            prefetched.cancel()
+
+    state_store.write_backfill(community.domain, last_id, total, processed, finished=True)
+    if live_cursor is None and last_id:
+        # Дальше сообщество продолжает обычный режим с последнего отправленного поста
+        state_store.write_cursor(community.domain, last_id)
+    progress.report()
+    logger.info(f"{community.domain}: backfill is finished, {processed} posts processed.")
+    return True
+
+
+async def run_backfill(bot: Bot, communities: list) -> dict:
+    # Communities are backfilled one after another so that every channel receives posts in order
+    return {community.domain: await backfill_community(bot, community) for community in communities}
@@ -0,0 +1,57 @@
+import json
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+import config
+from keyword_filter import KeywordFilter, compile_rules
+from routes import Route, compile_routes, default_routes
+
+
+@dataclass
+class Community:
+    domain: str
+    req_filter: str = config.REQ_FILTER
+    req_count: int = config.REQ_COUNT
+    whitelist: list = field(default_factory=lambda: list(config.WHITELIST))
+    blacklist: list = field(default_factory=lambda: list(config.BLACKLIST))
+    skip_ads_posts: bool = config.SKIP_ADS_POSTS
+    skip_copyrighted_post: bool = config.SKIP_COPYRIGHTED_POST
+    skip_reposts: bool = config.SKIP_REPOSTS
+    # Push mode (VAR_INGEST_MODE): community token for Bots Long Poll and Callback API confirmation code
+    group_id: int = 0
+    group_token: str = config.VK_GROUP_TOKEN
+    callback_confirmation: str = config.CALLBACK_CONFIRMATION
+    # Telegram chats and Discord servers of this community, see VAR_ROUTES
+    routes: list = field(default_factory=default_routes)
+    destinations: list[Route] = field(init=False, repr=False)
+    whitelist_filter: KeywordFilter = field(init=False, repr=False)
+    blacklist_filter: KeywordFilter = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # Списки слов компилируются один раз при загрузке, а не на каждом посте
+        self.whitelist_filter = compile_rules(self.whitelist)
+        self.blacklist_filter = compile_rules(self.blacklist)
+        self.destinations = compile_routes(self.routes)
+
+
+def load_communities() -> list[Community]:
+    # Priority: VAR_COMMUNITIES_FILE, then VAR_VK_DOMAINS, then the single VAR_VK_DOMAIN.
+    # Every entry is a domain string or an object overriding the global filters for this community.
+    if config.COMMUNITIES_FILE:
+        with open(config.COMMUNITIES_FILE, "r", encoding="utf-8") as file:
+            entries = json.load(file)
+    elif config.VK_DOMAINS:
+        entries = config.VK_DOMAINS
+    else:
+        entries = [config.VK_DOMAIN]
+
+    communities = []
+    for entry in entries:
+        community = Community(domain=entry) if isinstance(entry, str) else Community(**entry)
+        if community.domain in (c.domain for c in communities):
+            logger.warning(f"Community {community.domain} is listed twice, the duplicate is ignored.")
+            continue
+        communities.append(community)
+    logger.info(f"Watching {len(communities)} VK communities: {', '.join(c.domain for c in communities)}.")
+    return communities
@@ -8,17 +8,75 @@ dotenv.load_dotenv()
 
 TG_CHANNEL: str = os.getenv("VAR_TG_CHANNEL", "")
 TG_BOT_TOKEN: str = os.getenv("VAR_TG_BOT_TOKEN", "")
+TG_GLOBAL_RATE: float = float(os.getenv("VAR_TG_GLOBAL_RATE", 30))
+TG_CHAT_RATE_PER_MINUTE: float = float(os.getenv("VAR_TG_CHAT_RATE_PER_MINUTE", 20))
+TG_CHAT_RATE: float = float(os.getenv("VAR_TG_CHAT_RATE", 1))
+# Bot API server, e.g. a local telegram-bot-api instance; empty for api.telegram.org
+TG_API_URL: str = os.getenv("VAR_TG_API_URL", "")
 VK_TOKEN: str = os.getenv("VAR_VK_TOKEN", "")
 VK_DOMAIN: str = os.getenv("VAR_VK_DOMAIN", "")
+# Several communities in one process: JSON list of domains/objects or a JSON file with the same list
+VK_DOMAINS: list = json.loads(os.getenv("VAR_VK_DOMAINS", "[]"))
+COMMUNITIES_FILE: str = os.getenv("VAR_COMMUNITIES_FILE", "")
 DISCORDBOT_TOKEN: str = os.getenv("VAR_DISCORDBOT_TOKEN", "")
 DISCORDSERVER_ID: int = int(os.getenv("VAR_DISCORDSERVER_ID", 0))
+STATE_DB: str = os.getenv("VAR_STATE_DB", "./data/state.db")
+WEBHOOKS_FILE: str = os.getenv("VAR_WEBHOOKS_FILE", "./data/webhooks.json")
+WEBHOOKS_TTL: int = int(os.getenv("VAR_WEBHOOKS_TTL", 3600))
+# Bytes of attachments in one Discord message (10 MiB without server boosts)
+DISCORD_UPLOAD_LIMIT: int = int(os.getenv("VAR_DISCORD_UPLOAD_LIMIT", 10485760))
+# Destinations of every community: JSON list of {"telegram": chat} / {"discord": server_id}
+# with optional "tags", "whitelist" and "blacklist"; empty means VAR_TG_CHANNEL and VAR_DISCORDSERVER_ID
+ROUTES: list = json.loads(os.getenv("VAR_ROUTES", "[]"))
 
+VK_API_URL: str = os.getenv("VAR_VK_API_URL", "https://api.vk.com/method")
 REQ_VERSION: float = float(os.getenv("VAR_REQ_VERSION", 5.103))
 REQ_COUNT: int = int(os.getenv("VAR_REQ_COUNT", 3))
 REQ_FILTER: str = os.getenv("VAR_REQ_FILTER", "owner")
+VK_REQUESTS_PER_SECOND: float = float(os.getenv("VAR_VK_REQUESTS_PER_SECOND", 3))
+MAX_DOC_SIZE: int = int(os.getenv("VAR_MAX_DOC_SIZE", 50000000))
+DOWNLOAD_CONCURRENCY: int = int(os.getenv("VAR_DOWNLOAD_CONCURRENCY", 4))
+MEDIA_CACHE_DIR: str = os.getenv("VAR_MEDIA_CACHE_DIR", "./data/media")
+MEDIA_CACHE_SIZE: int = int(os.getenv("VAR_MEDIA_CACHE_SIZE", 500000000))
+# Oversized images are re-encoded to fit Telegram/Discord limits in a process pool (needs Pillow).
+# Image documents up to MEDIA_TRANSFORM_MAX_SOURCE bytes are downloaded for that instead of being skipped.
+MEDIA_TRANSFORM: bool = os.getenv("VAR_MEDIA_TRANSFORM", "").lower() in ("true",)
+MEDIA_TRANSFORM_WORKERS: int = int(os.getenv("VAR_MEDIA_TRANSFORM_WORKERS", 2))
+MEDIA_TRANSFORM_QUALITY: int = int(os.getenv("VAR_MEDIA_TRANSFORM_QUALITY", 85))
+MEDIA_TRANSFORM_MAX_SOURCE: int = int(os.getenv("VAR_MEDIA_TRANSFORM_MAX_SOURCE", 200000000))
+MEDIA_TRANSFORM_CACHE_SIZE: int = int(os.getenv("VAR_MEDIA_TRANSFORM_CACHE_SIZE", 500000000))
+GROUP_NAMES_CACHE_SIZE: int = int(os.getenv("VAR_GROUP_NAMES_CACHE_SIZE", 1000))
+
+# "poll" (wall.get on the adaptive schedule of poll_scheduler), "longpoll" (Bots Long Poll) or "callback" (Callback API server)
+INGEST_MODE: str = os.getenv("VAR_INGEST_MODE", "poll").lower()
+VK_GROUP_TOKEN: str = os.getenv("VAR_VK_GROUP_TOKEN", "")
+CALLBACK_HOST: str = os.getenv("VAR_CALLBACK_HOST", "0.0.0.0")
+CALLBACK_PORT: int = int(os.getenv("VAR_CALLBACK_PORT", 8080))
+CALLBACK_PATH: str = os.getenv("VAR_CALLBACK_PATH", "/vk/callback")
+CALLBACK_CONFIRMATION: str = os.getenv("VAR_CALLBACK_CONFIRMATION", "")
+CALLBACK_SECRET: str = os.getenv("VAR_CALLBACK_SECRET", "")
+
+# Prometheus /metrics endpoint; 0 disables it
+METRICS_HOST: str = os.getenv("VAR_METRICS_HOST", "0.0.0.0")
+METRICS_PORT: int = int(os.getenv("VAR_METRICS_PORT", 0))
+
+# Backfill mode (--backfill): posts resolved ahead of the one being sent, progress log interval in seconds
+BACKFILL_CONCURRENCY: int = int(os.getenv("VAR_BACKFILL_CONCURRENCY", 4))
+BACKFILL_REPORT_INTERVAL: float = float(os.getenv("VAR_BACKFILL_REPORT_INTERVAL", 30))
+
+# Profiling of every cycle (same as running with --profile)
+PROFILE: bool = os.getenv("VAR_PROFILE", "").lower() in ("true",)
+PROFILE_DIR: str = os.getenv("VAR_PROFILE_DIR", "./data/profile")
+PROFILE_KEEP: int = int(os.getenv("VAR_PROFILE_KEEP", 50))
+PROFILE_TOP: int = int(os.getenv("VAR_PROFILE_TOP", 25))
+PROFILE_FRAMES: int = int(os.getenv("VAR_PROFILE_FRAMES", 10))
 
 SINGLE_START: bool = os.getenv("VAR_SINGLE_START", "").lower() in ("true",)
 TIME_TO_SLEEP: int = int(os.getenv("VAR_TIME_TO_SLEEP", 120))
+POLL_MIN_INTERVAL: int = int(os.getenv("VAR_POLL_MIN_INTERVAL", 30))
+# По умолчанию интервал не растягивается дольше TIME_TO_SLEEP: редкий опрос тихих стен включается явно
+POLL_MAX_INTERVAL: int = int(os.getenv("VAR_POLL_MAX_INTERVAL", TIME_TO_SLEEP))
+POLL_JITTER: float = float(os.getenv("VAR_POLL_JITTER", 0.1))
 SKIP_ADS_POSTS: bool = os.getenv("VAR_SKIP_ADS_POSTS", "").lower() in ("true",)
 SKIP_COPYRIGHTED_POST: bool = os.getenv("VAR_SKIP_COPYRIGHTED_POST", "").lower() in ("true")
 SKIP_REPOSTS: bool = os.getenv("VAR_SKIP_REPOSTS", "").lower() in ("true")
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+from loguru import logger
+
+
+class WebhookBucket:
+    # Rate-limit state of one webhook, taken from Discord's X-RateLimit-* headers.
+    # Requests to the same webhook go one by one; different webhooks never wait for each other.
+
+    def __init__(self) -> None:
+        self.remaining = None
+        self.reset_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "WebhookBucket":
+        await self._lock.acquire()
+        delay = self.reset_at - time.monotonic()
+        if self.remaining == 0 and delay > 0:
+            logger.info(f"Discord webhook bucket is empty. Sleep {delay:.2f} seconds.")
+            await asyncio.sleep(delay)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._lock.release()
+
+    def update(self, headers) -> None:
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset-After" in headers:
+            self.reset_at = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+
+    def block(self, retry_after: float) -> None:
+        # 429: nothing goes through this webhook until retry_after passes
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + retry_after)
+
+
+_buckets: dict = {}
+
+
+def get_bucket(webhook_url: str) -> WebhookBucket:
+    if webhook_url not in _buckets:
+        _buckets[webhook_url] = WebhookBucket()
+    return _buckets[webhook_url]
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from typing import Union
+
+import discord
+from discord.ext import commands
+from loguru import logger
+
+from config import DISCORDSERVER_ID, WEBHOOKS_FILE, WEBHOOKS_TTL
+from webhook_directory import WebhookDirectory
+
+LOGIN_BACKOFF = 30  # seconds before the first new login after a failed one, doubled up to LOGIN_BACKOFF_MAX
+LOGIN_BACKOFF_MAX = 900
+
+
+class DiscordService:
+    # One gateway connection for the whole life of the process, opened only when a webhook directory
+    # has to be built: posts themselves go through webhooks.
+    # The client runs as a task on the main event loop next to the VK polling and Telegram sends.
+    # One client serves every Discord server of the routing table, each with its own webhook directory.
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+        self.directories: dict = {}  # server_id -> WebhookDirectory
+        self.bot: Union[commands.Bot, None] = None
+        self._task: Union[asyncio.Task, None] = None
+        self._ready = asyncio.Event()
+        self._deadline = 0.0  # monotonic time until which callers wait for the current login
+        self._retry_at = 0.0  # no new login before this monotonic time
+        self._failures = 0
+
+        self.connections = 0  # gateway sessions opened (on_ready calls)
+        self.sends = 0
+        self.sends_on_connection = 0
+        self.last_send_latency = 0.0
+        self.total_send_latency = 0.0
+
+    def webhooks(self, server_id: int) -> WebhookDirectory:
+        if server_id not in self.directories:
+            self.directories[server_id] = WebhookDirectory(webhooks_path(server_id), server_id, WEBHOOKS_TTL)
+            if self.is_ready:
+                self.directories[server_id].start_background_refresh(self.bot)
+        return self.directories[server_id]
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set() and self.bot is not None and not self.bot.is_closed()
+
+    async def start(self, timeout: float = 60) -> bool:
+        # Returns as soon as the gateway is ready or the login has failed. Every caller shares one
+        # deadline per login, so a gateway that does not come up delays posts by `timeout` once, not each time.
+        if self.is_ready:
+            return True
+        if self._task is None or self._task.done():
+            if time.monotonic() < self._retry_at:
+                return False
+            self._ready.clear()
+            self._deadline = time.monotonic() + timeout
+            self._task = asyncio.create_task(self._run())
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        ready = asyncio.create_task(self._ready.wait())
+        try:
+            await asyncio.wait({ready, self._task}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            ready.cancel()
+        if self.is_ready:
+            return True
+        if not self._task.done():
+            logger.error(f"Discord bot is not ready after {timeout} seconds.")
+        return False
+
+    async def _run(self) -> None:
+        intents = discord.Intents.default()
+        self.bot = commands.Bot(command_prefix="!", intents=intents)
+
+        @self.bot.event
+        async def on_ready():
+            self.connections += 1
+            self._failures = 0
+            self.sends_on_connection = 0
+            for directory in self.directories.values():
+                directory.start_background_refresh(self.bot)
+            self._ready.set()
+            logger.info(f"Discord bot is connected. Gateway session #{self.connections}.")
+
+        @self.bot.event
+        async def on_disconnect():
+            logger.warning("Discord gateway connection lost, waiting for reconnect.")
+
+        @self.bot.event
+        async def on_resumed():
+            logger.info(f"Discord gateway session #{self.connections} resumed.")
+
+        try:
+            await self.bot.start(self.token)
+        except Exception as e:
+            self._failures += 1
+            backoff = min(LOGIN_BACKOFF * 2 ** (self._failures - 1), LOGIN_BACKOFF_MAX)
+            self._retry_at = time.monotonic() + backoff
+            logger.error(f"Discord bot stopped: {e}. Next login attempt in {backoff} seconds.")
+        finally:
+            self._ready.clear()
+
+    async def run(self, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.last_send_latency = time.perf_counter() - started
+            self.total_send_latency += self.last_send_latency
+            self.sends += 1
+            self.sends_on_connection += 1
+            logger.info(
+                f"Discord send took {self.last_send_latency:.2f}s "
+                f"(gateway session #{self.connections}, reused {self.sends_on_connection - 1} times, "
+                f"avg {self.total_send_latency / self.sends:.2f}s over {self.sends} sends)."
+            )
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "sends": self.sends,
+            "sends_on_connection": self.sends_on_connection,
+            "last_send_latency": self.last_send_latency,
+            "avg_send_latency": self.total_send_latency / self.sends if self.sends else 0.0,
+        }
+
+    async def stop(self) -> None:
+        if self.bot is not None and not self.bot.is_closed():
+            await self.bot.close()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+_service: Union[DiscordService, None] = None
+
+
+def webhooks_path(server_id: int) -> str:
+    # VAR_WEBHOOKS_FILE keeps the server of VAR_DISCORDSERVER_ID, other servers get a file next to it
+    if server_id == DISCORDSERVER_ID:
+        return WEBHOOKS_FILE
+    root, ext = os.path.splitext(WEBHOOKS_FILE)
+    return f"{root}-{server_id}{ext}"
+
+
+def get_discord_service(token: str) -> DiscordService:
+    # The gateway is connected by start(), only when a webhook directory has to be built
+    global _service
+    if _service is None:
+        _service = DiscordService(token)
+    return _service
+
+
+async def stop_discord_service() -> None:
+    global _service
+    if _service is not None:
+        await _service.stop()
+        _service = None
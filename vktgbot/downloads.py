@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import os
+from typing import Union
+
+import aiohttp
+from loguru import logger
+
+from config import DOWNLOAD_CONCURRENCY, MAX_DOC_SIZE
+from http_session import get_session
+from metrics import bytes_downloaded, stage_seconds
+
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+
+
+# Файл пишется на диск по частям, целиком в памяти он не держится.
+# Слишком большой файл отбрасывается по Content-Length, а если его нет — по счётчику байт.
+async def download_file(
+    url: str, folder: str, max_size: int = MAX_DOC_SIZE, reserved_names: Union[set, None] = None
+) -> Union[dict, None]:
+    with stage_seconds.time("download"):
+        return await _download_file(url, folder, max_size, reserved_names)
+
+
+async def _download_file(url: str, folder: str, max_size: int, reserved_names: Union[set, None]) -> Union[dict, None]:
+    try:
+        async with get_session().get(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status != 200:
+                logger.error(f"Failed to download {url}: HTTP {response.status}.")
+                return None
+            if response.content_length is not None and response.content_length > max_size:
+                logger.info(f"The document was skipped due to its size exceeding the limit: {response.content_length=}.")
+                return None
+
+            url_last_part = str(response.url).split("/")[-1]
+            correct_filename = unique_filename(url_last_part.split("?")[0], reserved_names)
+            path = os.path.join(folder, correct_filename)
+
+            size = 0
+            digest = hashlib.sha256()
+            with open(path, "wb") as file:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    bytes_downloaded.inc(amount=len(chunk))
+                    if size > max_size:
+                        break
+                    file.write(chunk)
+                    digest.update(chunk)
+            if size > max_size:
+                os.remove(path)
+                logger.info(f"The document was skipped due to its size exceeding the limit: {url}.")
+                return None
+            return {
+                "title": correct_filename,
+                "url": str(response.url),
+                "path": path,
+                "size": size,
+                "sha256": digest.hexdigest(),
+            }
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.error(f"Failed to download {url}: {ex!r}")
+        return None
+
+
+# Все вложения поста скачиваются одновременно, но не больше DOWNLOAD_CONCURRENCY за раз
+async def download_files(urls: list, folder: str, max_size: int = MAX_DOC_SIZE) -> list:
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    reserved_names: set = set()
+
+    async def download(url: str) -> Union[dict, None]:
+        async with semaphore:
+            return await download_file(url, folder, max_size, reserved_names)
+
+    results = await asyncio.gather(*(download(url) for url in urls))
+    return list(results)
+
+
+def unique_filename(filename: str, reserved_names: Union[set, None]) -> str:
+    # Два вложения с одинаковым именем не должны писать в один файл
+    if reserved_names is None:
+        return filename
+    name, ext = os.path.splitext(filename)
+    candidate, number = filename, 1
+    while candidate in reserved_names:
+        candidate = f"{name}({number}){ext}"
+        number += 1
+    reserved_names.add(candidate)
+    return candidate
@@ -0,0 +1,23 @@
+from typing import Union
+
+import aiohttp
+
+# Один пул соединений на весь процесс (вебхуки Discord, загрузки, VK API)
+_session: Union[aiohttp.ClientSession, None] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=10, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=120, connect=10),
+        )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,110 @@
+import re
+from collections import deque
+
+from loguru import logger
+
+HASHTAG_RE = re.compile(r"#\w+")
+# Below this many words str.find in C beats walking the automaton in Python
+AUTOMATON_MIN_WORDS = 200
+
+
+class KeywordFilter:
+    # Whitelist/blacklist rules compiled once:
+    #   "word"      - substring, case-insensitive (long lists share one Aho–Corasick automaton);
+    #                 "#ad" is a word too and matches "#ads", as it always did
+    #   "tag:#tag"  - whole hashtag of the post, case-insensitive ("tag:#music" does not match "#musicvideo")
+    #   "re:<expr>" - regular expression, case-insensitive
+    # matches() finds every rule present in the text in one pass, whatever the number of words.
+
+    def __init__(self, rules: list) -> None:
+        self.rules = list(rules)
+        self.hashtags: dict = {}
+        self.patterns: list = []
+        self.words: list = []
+        self._goto: list = [{}]
+        self._fail: list = [0]
+        self._output: list = [()]
+
+        for rule in self.rules:
+            if rule.startswith("re:"):
+                try:
+                    self.patterns.append((rule, re.compile(rule[3:], re.IGNORECASE)))
+                except re.error as ex:
+                    logger.error(f"Filter rule {rule!r} is not a valid regular expression and is ignored: {ex}")
+            elif rule.startswith("tag:"):
+                tag = "#" + rule[4:].lstrip("#")
+                if HASHTAG_RE.fullmatch(tag):
+                    self.hashtags[tag.lower()] = rule
+                else:
+                    logger.error(f"Filter rule {rule!r} is not a hashtag and is ignored.")
+            elif rule:
+                self.words.append((rule, rule.lower()))
+        if len(self.words) >= AUTOMATON_MIN_WORDS:
+            for rule, word in self.words:
+                self._add_word(rule, word)
+            self._build_links()
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def _add_word(self, rule: str, word: str) -> None:
+        state = 0
+        for char in word:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state] += (rule,)
+
+    def _build_links(self) -> None:
+        # Failure links in BFS order; every state also reports the words ending in its suffixes
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def matches(self, text: str) -> list:
+        found: dict = {}
+        if self.words and len(self._goto) == 1:
+            text_lower = text.lower()
+            for rule, word in self.words:
+                if word in text_lower:
+                    found[rule] = None
+        elif len(self._goto) > 1:
+            goto, fail, output = self._goto, self._fail, self._output
+            state = 0
+            for char in text.lower():
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                if output[state]:
+                    for rule in output[state]:
+                        found[rule] = None
+        if self.hashtags:
+            for tag in HASHTAG_RE.findall(text):
+                rule = self.hashtags.get(tag.lower())
+                if rule:
+                    found[rule] = None
+        for rule, pattern in self.patterns:
+            if pattern.search(text):
+                found[rule] = None
+        return list(found)
+
+
+_compiled: dict = {}
+
+
+def compile_rules(rules: list) -> KeywordFilter:
+    # Communities with the same list (the global one, usually) share one compiled filter
+    key = tuple(rules)
+    if key not in _compiled:
+        _compiled[key] = KeywordFilter(rules)
+    return _compiled[key]
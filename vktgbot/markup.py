@@ -0,0 +1,125 @@
+import re
+from dataclasses import dataclass
+
+# VK post markup is parsed once into a flat list of nodes; Telegram and Discord text are rendered from it.
+#   [id1|Name], [club1|Name], [durov|Name], [https://...|Name] -> link
+#   https://...                                                -> url
+#   #tag                                                       -> hashtag
+TOKEN_RE = re.compile(
+    r"\[(?P<target>[\w.]+|https?://[^\s|\]]+)\|(?P<label>[^\]\n]+)\]"
+    r"|(?P<url>https?://[^\s<>\"]+)"
+    r"|(?P<hashtag>#\w+)"
+)
+URL_TRAILING_PUNCTUATION = ".,;:!?"
+
+
+@dataclass(slots=True)
+class Node:
+    kind: str  # "text", "link", "url" or "hashtag"
+    text: str
+    url: str = ""
+    bold: bool = False
+
+
+def parse_markup(text: str) -> list[Node]:
+    nodes = []
+    position = 0
+    for match in TOKEN_RE.finditer(text):
+        start, end = match.span()
+        if match["url"]:
+            url = match["url"].rstrip(URL_TRAILING_PUNCTUATION)
+            end = start + len(url)
+            node = Node("url", url, url)
+        elif match["hashtag"]:
+            node = Node("hashtag", match["hashtag"])
+        else:
+            target = match["target"]
+            url = target if target.startswith("http") else f"https://vk.com/{target}"
+            node = Node("link", match["label"], url)
+        if start > position:
+            nodes.append(Node("text", text[position:start]))
+        nodes.append(node)
+        position = end
+        # Отрезанная пунктуация после ссылки остаётся обычным текстом
+        if end < match.end():
+            nodes.append(Node("text", text[end : match.end()]))
+            position = match.end()
+    if position < len(text):
+        nodes.append(Node("text", text[position:]))
+    return nodes
+
+
+def plain_text(nodes: list[Node]) -> str:
+    return "".join(node.text for node in nodes)
+
+
+def hashtags(nodes: list[Node]) -> list[str]:
+    return [node.text for node in nodes if node.kind == "hashtag"]
+
+
+def add_repost_link(nodes: list[Node], repost_url: str, item_type: str, group_name: str) -> list[Node]:
+    link = Node("link", f"REPOST ↓ {group_name}", repost_url, True)
+    if item_type == "post" and nodes:
+        return nodes + [Node("text", "\n\n"), link]
+    if item_type == "repost":
+        return [link, Node("text", "\n\n")] + nodes
+    return nodes
+
+
+def add_urls(nodes: list[Node], urls: list) -> list[Node]:
+    # Ссылки вложений, которых нет в тексте, дописываются в конец; первая ещё и даёт превью в Telegram
+    text = plain_text(nodes)
+    nodes = list(nodes)
+    first_link = True
+    for url in urls:
+        if url in text:
+            continue
+        if first_link:
+            if nodes:
+                nodes = [Node("link", " ", url)] + nodes + [Node("text", "\n\n"), Node("url", url, url)]
+            else:
+                nodes = [Node("url", url, url)]
+            first_link = False
+        else:
+            nodes += [Node("text", "\n"), Node("url", url, url)]
+    return nodes
+
+
+def escape_html(text: str) -> str:
+    # str.replace works in C, much faster than str.translate on Cyrillic text
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def render_html(nodes: list[Node]) -> str:
+    parts = []
+    for node in nodes:
+        if node.kind == "link":
+            label = escape_html(node.text)
+            if node.bold:
+                label = f"<b>{label}</b>"
+            parts.append(f'<a href="{escape_html(node.url)}">{label}</a>')
+        else:
+            parts.append(escape_html(node.text))
+    return "".join(parts)
+
+
+def escape_markdown_label(text: str) -> str:
+    # Скобки и обратная косая черта в подписи ломают разметку [label](url)
+    return text.replace("\\", "\\\\").replace("[", "\\[").replace("]", "\\]")
+
+
+def render_discord(nodes: list[Node]) -> str:
+    # В дискорд уходят только ссылки, по одной на строку, без повторов
+    links = []
+    seen = set()
+    for node in nodes:
+        if node.kind == "url":
+            link = node.url
+        elif node.kind == "link" and node.text.strip():
+            link = f"[{escape_markdown_label(node.text)}]({node.url})"
+        else:
+            continue
+        if link not in seen:
+            seen.add(link)
+            links.append(link)
+    return "\n".join(links)
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter, OrderedDict
+from typing import Union
+
+from loguru import logger
+
+from config import MAX_DOC_SIZE, MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE
+from downloads import download_files
+from metrics import Gauge
+
+
+class MediaCache:
+    # Content-addressed cache for photos and documents: every file is stored once as
+    # blobs/<sha256>, the index maps source url -> blob and keeps LRU order.
+    # Telegram docs, Discord photos/docs and every tag fan-out read from here.
+    # Every doc returned by fetch_many is pinned until release(): eviction never removes
+    # a file that a post waiting to be sent still refers to.
+
+    def __init__(self, folder: str, max_size: int) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self.blobs_folder = os.path.join(folder, "blobs")
+        self.tmp_folder = os.path.join(folder, "tmp")
+        self.index_path = os.path.join(folder, "index.json")
+
+        self.index: OrderedDict = OrderedDict()  # url -> {"sha256", "filename", "size"}
+        self.blob_refs: Counter = Counter()
+        self.total_size = 0
+        self._pending: dict = {}  # url -> Future, downloads in progress
+        self.pins: Counter = Counter()  # blob path -> docs handed out and not released yet
+        self._loaded = False
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_folder, sha256)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.blobs_folder, exist_ok=True)
+        shutil.rmtree(self.tmp_folder, ignore_errors=True)
+        os.makedirs(self.tmp_folder, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            entries = []
+        except ValueError as e:
+            logger.warning(f"Media cache index is unreadable and will be rebuilt: {e}")
+            entries = []
+
+        for url, entry in entries:
+            if os.path.exists(self.blob_path(entry["sha256"])):
+                self._add(url, entry)
+        # Blobs that are not referenced by the index anymore
+        for sha256 in os.listdir(self.blobs_folder):
+            if sha256 not in self.blob_refs:
+                os.remove(self.blob_path(sha256))
+        logger.info(f"Media cache loaded: {len(self.index)} files, {self.total_size} bytes.")
+
+    def _save(self) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(list(self.index.items()), file, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _add(self, url: str, entry: dict) -> None:
+        if self.blob_refs[entry["sha256"]] == 0:
+            self.total_size += entry["size"]
+        self.blob_refs[entry["sha256"]] += 1
+        self.index[url] = entry
+
+    def _remove(self, url: str) -> None:
+        entry = self.index.pop(url)
+        self.blob_refs[entry["sha256"]] -= 1
+        if self.blob_refs[entry["sha256"]] == 0:
+            del self.blob_refs[entry["sha256"]]
+            self.total_size -= entry["size"]
+            try:
+                os.remove(self.blob_path(entry["sha256"]))
+            except FileNotFoundError:
+                pass
+
+    def _store(self, url: str, doc: dict) -> dict:
+        entry = {"sha256": doc["sha256"], "filename": doc["title"], "size": doc["size"]}
+        if url in self.index:
+            self._remove(url)
+        if os.path.exists(self.blob_path(entry["sha256"])):
+            os.remove(doc["path"])  # same content already cached under another url
+        else:
+            os.replace(doc["path"], self.blob_path(entry["sha256"]))
+        self._add(url, entry)
+        return entry
+
+    def _evict(self) -> None:
+        for url in list(self.index):
+            if self.total_size <= self.max_size or len(self.index) <= 1:
+                break
+            if self.pins[self.blob_path(self.index[url]["sha256"])]:
+                continue
+            logger.debug(f"Media cache evicts {url}.")
+            self._remove(url)
+
+    def _as_doc(self, url: str, entry: Union[dict, None]) -> Union[dict, None]:
+        if entry is None:
+            return None
+        return {
+            "title": entry["filename"],
+            "url": url,
+            "path": self.blob_path(entry["sha256"]),
+            "size": entry["size"],
+            "sha256": entry["sha256"],
+        }
+
+    async def fetch_many(self, urls: list, max_size: int = MAX_DOC_SIZE) -> list:
+        # Returns doc dicts (or None for files that could not be downloaded) in the order of urls.
+        # The caller must pass the result to release() once the files are not needed anymore.
+        self._load()
+        docs: dict = {}
+        to_download: list = []
+        waiting: dict = {}
+        for url in dict.fromkeys(urls):
+            if url in self.index:
+                self.index.move_to_end(url)
+                docs[url] = self._pin(url, self.index[url])
+                self.hits += 1
+                self.bytes_saved += self.index[url]["size"]
+            elif url in self._pending:
+                waiting[url] = self._pending[url]
+            else:
+                to_download.append(url)
+                self._pending[url] = asyncio.get_running_loop().create_future()
+
+        try:
+            if to_download:
+                self.misses += len(to_download)
+                folder = tempfile.mkdtemp(dir=self.tmp_folder)
+                try:
+                    for url, doc in zip(to_download, await download_files(to_download, folder, max_size)):
+                        entry = self._store(url, doc) if doc else None
+                        docs[url] = self._pin(url, entry)
+                        if doc:
+                            self.bytes_downloaded += doc["size"]
+                        self._pending.pop(url).set_result(entry)
+                finally:
+                    for url in to_download:
+                        if url in self._pending:
+                            self._pending.pop(url).set_result(None)
+                    shutil.rmtree(folder, ignore_errors=True)
+                self._evict()
+                self._save()
+
+            for url, future in waiting.items():
+                # Another sink is downloading the same file right now
+                entry = await asyncio.shield(future)
+                if entry and url not in self.index:
+                    # Evicted before this call resumed: downloaded again
+                    docs[url] = (await self.fetch_many([url], max_size))[0]
+                elif entry:
+                    docs[url] = self._pin(url, entry)
+                    self.hits += 1
+                    self.bytes_saved += entry["size"]
+        except BaseException:
+            self.release(list(docs.values()))
+            raise
+
+        result = [docs.get(url) for url in urls]
+        # Every returned doc holds one pin, also a url listed twice
+        for url, count in Counter(urls).items():
+            if docs.get(url) and count > 1:
+                self.pins[docs[url]["path"]] += count - 1
+        return result
+
+    def _pin(self, url: str, entry: Union[dict, None]) -> Union[dict, None]:
+        doc = self._as_doc(url, entry)
+        if doc:
+            self.pins[doc["path"]] += 1
+        return doc
+
+    def release(self, docs: list) -> None:
+        # Unpins docs returned by fetch_many; files that are not cached here are ignored
+        for doc in docs:
+            if doc and self.pins[doc["path"]] > 0:
+                self.pins[doc["path"]] -= 1
+                if not self.pins[doc["path"]]:
+                    del self.pins[doc["path"]]
+        if self._loaded and self.total_size > self.max_size:
+            self._evict()
+            self._save()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "files": len(self.index),
+            "size": self.total_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE)
+Gauge("vktgbot_pending_downloads", "Media downloads in progress.", lambda: len(media_cache._pending))
@@ -0,0 +1,218 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+from loguru import logger
+
+from config import (
+    MEDIA_CACHE_DIR,
+    MEDIA_TRANSFORM,
+    MEDIA_TRANSFORM_CACHE_SIZE,
+    MEDIA_TRANSFORM_QUALITY,
+    MEDIA_TRANSFORM_WORKERS,
+)
+from metrics import stage_seconds
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it oversized images are skipped as before
+    Image = None
+
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "bmp", "tif", "tiff"}
+THUMBNAIL_SIZE = 320  # Telegram document thumbnails: JPEG, at most 320x320 and 200 kB
+MAX_ATTEMPTS = 8
+
+
+def is_image(title: str) -> bool:
+    return os.path.splitext(title)[1].lstrip(".").lower() in IMAGE_EXTENSIONS
+
+
+# Функции ниже выполняются в процессах пула: только пути и числа на входе и выходе
+
+
+def _open_rgb(path: str):
+    image = ImageOps.exif_transpose(Image.open(path))
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+def fit_image(source: str, target: str, max_bytes: int, quality: int) -> Union[int, None]:
+    # Re-encodes as JPEG, downscaling until the file fits max_bytes; returns the new size
+    image = _open_rgb(source)
+    width, height = image.size
+    scale = 1.0
+    for _ in range(MAX_ATTEMPTS):
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        resized = image.resize(size, Image.LANCZOS) if scale < 1 else image
+        buffer = io.BytesIO()
+        resized.save(buffer, "JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            with open(target, "wb") as file:
+                file.write(buffer.getbuffer())
+            return buffer.tell()
+        scale *= max(0.5, (max_bytes / buffer.tell()) ** 0.5 * 0.95)
+    return None
+
+
+def make_thumbnail(source: str, target: str, side: int) -> int:
+    image = _open_rgb(source)
+    image.thumbnail((side, side), Image.LANCZOS)
+    image.save(target, "JPEG", quality=80)
+    return os.path.getsize(target)
+
+
+class MediaTransformer:
+    # Downsizes and re-encodes images that exceed a destination's size limit and makes
+    # document thumbnails in a process pool, so decoding and encoding never block the event loop.
+    # Results are files named by the sha256 of the source and the parameters, so a photo
+    # sent to several destinations or posted again is transformed once.
+    # Like the media cache, every doc returned by fit()/fit_many() is pinned until release().
+
+    def __init__(self, folder: str, workers: int, quality: int, max_size: int, enabled: bool = True) -> None:
+        self.folder = folder
+        self.workers = max(1, workers)
+        self.quality = quality
+        self.max_size = max_size
+        self.enabled = enabled and Image is not None
+        self._executor: Union[ProcessPoolExecutor, None] = None
+        self._pending: dict = {}  # result path -> Future, transforms in progress
+        self.pins: Counter = Counter()  # path -> docs handed out and not released yet
+
+        self.transformed = 0
+        self.hits = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        if enabled and Image is None:
+            logger.warning("Pillow is not installed: oversized images are not recompressed.")
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            os.makedirs(self.folder, exist_ok=True)
+            # spawn: a forked worker would inherit the threads, sockets and SQLite connection of the bot
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, target: str, function, source: str, *args) -> Union[int, None]:
+        # One transform per result file, concurrent callers wait for it
+        while target in self._pending:
+            if await asyncio.shield(self._pending[target]) is None:
+                return None
+        if os.path.exists(target):
+            self.hits += 1
+            os.utime(target)
+            return os.path.getsize(target)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[target] = future
+        tmp_target = f"{target}.tmp"
+        try:
+            with stage_seconds.time("transform"):
+                size = await asyncio.get_running_loop().run_in_executor(self.executor, function, source, tmp_target, *args)
+            if size is not None:
+                os.replace(tmp_target, target)
+                self.transformed += 1
+                self._prune(target)
+        except Exception as ex:
+            logger.error(f"Image transform of {source} failed: {ex!r}")
+            size = None
+        finally:
+            if os.path.exists(tmp_target):
+                os.remove(tmp_target)
+            self._pending.pop(target)
+            future.set_result(size)
+        if size is None:
+            self.failed += 1
+        return size
+
+    async def fit(self, doc: dict, max_bytes: int) -> Union[dict, None]:
+        # doc from the media cache; returns it as is if it fits, a re-encoded copy, or None
+        if doc["size"] <= max_bytes:
+            return self._pin(doc)
+        if not self.enabled or not is_image(doc["title"]):
+            return None
+        target = os.path.join(self.folder, f"{doc['sha256']}-{max_bytes}-q{self.quality}.jpg")
+        size = await self._run(target, fit_image, doc["path"], max_bytes, self.quality)
+        if size is None:
+            return None
+        self.bytes_in += doc["size"]
+        self.bytes_out += size
+        logger.info(f"Image {doc['title']} is recompressed to fit {max_bytes} bytes: {doc['size']} -> {size}.")
+        title = os.path.splitext(doc["title"])[0] + ".jpg"
+        return self._pin(dict(doc, title=title, path=target, size=size))
+
+    async def fit_many(self, docs: list, max_bytes: int) -> list:
+        # Oversized files that are not images (or could not be recompressed) are dropped
+        tasks = [asyncio.ensure_future(self.fit(doc, max_bytes)) for doc in docs]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            self.release([task.result() for task in tasks if task.done() and not task.cancelled() and not task.exception()])
+            raise
+        for doc, result in zip(docs, results):
+            if result is None:
+                logger.warning(f"File {doc['title']} ({doc['size']} bytes) exceeds the limit of {max_bytes} bytes and is skipped.")
+        return [result for result in results if result is not None]
+
+    def _pin(self, doc: dict) -> dict:
+        self.pins[doc["path"]] += 1
+        return doc
+
+    def release(self, docs: list) -> None:
+        for doc in docs:
+            if doc and self.pins[doc["path"]] > 0:
+                self.pins[doc["path"]] -= 1
+                if not self.pins[doc["path"]]:
+                    del self.pins[doc["path"]]
+
+    async def thumbnail(self, doc: dict) -> Union[str, None]:
+        # The file is only safe to open before the next await: it is not pinned
+        if not self.enabled or not is_image(doc["title"]):
+            return None
+        target = os.path.join(self.folder, f"{doc['sha256']}-thumb{THUMBNAIL_SIZE}.jpg")
+        size = await self._run(target, make_thumbnail, doc["path"], THUMBNAIL_SIZE)
+        return target if size is not None else None
+
+    def _prune(self, keep: str) -> None:
+        # Oldest results go first once the folder outgrows max_size; pinned files and `keep` stay
+        entries = [entry for entry in os.scandir(self.folder) if entry.is_file() and entry.name.endswith(".jpg")]
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if total <= self.max_size:
+                break
+            if entry.path == keep or self.pins[entry.path]:
+                continue
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def stats(self) -> dict:
+        return {
+            "transformed": self.transformed,
+            "hits": self.hits,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+media_transformer = MediaTransformer(
+    os.path.join(MEDIA_CACHE_DIR, "transformed"),
+    MEDIA_TRANSFORM_WORKERS,
+    MEDIA_TRANSFORM_QUALITY,
+    MEDIA_TRANSFORM_CACHE_SIZE,
+    MEDIA_TRANSFORM,
+)
@@ -0,0 +1,129 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Union
+
+from aiohttp import web
+from loguru import logger
+
+# Prometheus text exposition format, without the client library.
+# Metrics are module-level objects; /metrics renders all of them on every scrape.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    # The value is read from a callback at scrape time, e.g. the length of a queue
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        _registry.append(self)
+
+    def render(self) -> list:
+        try:
+            value = self.callback()
+        except Exception as ex:
+            logger.warning(f"Metric {self.name} is unavailable: {ex!r}")
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.series: dict = {}  # labels -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, *labels, value: float) -> None:
+        series = self.series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - started)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+stage_seconds = Histogram(
+    "vktgbot_stage_duration_seconds",
+    "Time spent in a pipeline stage: fetch, parse, download, telegram, discord.",
+    ("stage",),
+)
+retries = Counter("vktgbot_retries_total", "Repeated attempts to send a post or a request.", ("destination",))
+flood_waits = Counter("vktgbot_flood_waits_total", "Rate limit answers (Telegram flood-wait, Discord 429, VK error 6).", ("destination",))
+posts_skipped = Counter("vktgbot_posts_skipped_total", "Posts not sent, by reason.", ("reason",))
+posts_sent = Counter("vktgbot_posts_sent_total", "Post parts delivered, by destination.", ("destination",))
+telegram_files = Counter("vktgbot_telegram_file_cache_total", "Telegram file_id cache lookups, by result.", ("result",))
+upload_bytes_saved = Counter("vktgbot_telegram_upload_bytes_saved_total", "Upload bytes saved by reusing Telegram file_ids.")
+bytes_downloaded = Counter("vktgbot_downloaded_bytes_total", "Bytes of media downloaded from VK.")
+
+
+async def start_metrics_server(host: str, port: int) -> Union[web.AppRunner, None]:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as ex:
+        logger.error(f"Metrics server could not start on {host}:{port}: {ex!r}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Metrics are served on http://{host}:{port}/metrics.")
+    return runner
@@ -1,77 +1,110 @@
 import re
+from dataclasses import dataclass
 from typing import Union
 
-import requests
 from loguru import logger
 
-from api_requests import get_video_url
-from config import REQ_VERSION, VK_TOKEN
-from tools import add_urls_to_text, prepare_text_for_html, prepare_text_for_reposts, reformat_vk_links
+from attachments import DocRef, Link, Photo, VideoRef
+from config import MAX_DOC_SIZE, MEDIA_TRANSFORM_MAX_SOURCE
+from media_cache import media_cache
+from media_transform import IMAGE_EXTENSIONS, media_transformer
+from markup import add_repost_link, add_urls, hashtags, parse_markup, render_discord, render_html
 
 
-def parse_post(item: dict, repost_exists: bool, item_type: str, group_name: str) -> dict:
-    text = prepare_text_for_html(item["text"])
-    if repost_exists:
-        text = prepare_text_for_reposts(text, item, item_type, group_name)
-
-    text = reformat_vk_links(text)
+@dataclass
+class ParsedPost:
+    item_type: str  # "post" or "repost"
+    nodes: list
+    tags: list
+    attachments: list  # Photo, VideoRef, DocRef and Link handles
+    repost_url: str = ""
+    repost_owner_id: int = 0
 
-    urls: list = []
-    videos: list = []
-    photos: list = []
-    docs: list = []
-    tags: list = []
 
-    tags = get_tags(text)
+# Чистое преобразование без сети: пачку постов можно разобрать целиком до любых запросов
+def parse_post(item: dict, repost_exists: bool, item_type: str) -> ParsedPost:
+    parsed = ParsedPost(item_type, parse_markup(item["text"]), [], [])
+    parsed.tags = get_tags(parsed.nodes)
+    if repost_exists:
+        source = item["copy_history"][0] if item_type == "post" else item
+        parsed.repost_url = f"https://vk.com/wall{source['from_id']}_{source['id']}"
+        parsed.repost_owner_id = source["owner_id"]
     if "attachments" in item:
-        parse_attachments(item["attachments"], text, urls, videos, photos, docs)
+        parsed.attachments = parse_attachments(item["attachments"], item["text"])
+    return parsed
 
-    text = add_urls_to_text(text, urls, videos)
-    logger.info(f"{item_type.capitalize()} parsing is complete.")
-    return {"text": text, "photos": photos, "docs": docs, "tags": tags}
 
-
-def parse_attachments(attachments, text, urls, videos, photos, docs):
+def parse_attachments(attachments: list, text: str) -> list:
+    handles = []
     for attachment in attachments:
         if attachment["type"] == "link":
-            url = get_url(attachment, text)
-            if url:
-                urls.append(url)
+            handle = get_url(attachment, text)
         elif attachment["type"] == "video":
-            video = get_video(attachment)
-            if video:
-                videos.append(video)
+            handle = get_video(attachment)
         elif attachment["type"] == "photo":
-            photo = get_photo(attachment)
-            if photo:
-                photos.append(photo)
+            handle = get_photo(attachment)
         elif attachment["type"] == "doc":
-            doc = get_doc(attachment["doc"])
-            if doc:
-                docs.append(doc)
-
-
-def get_url(attachment: dict, text: str) -> Union[str, None]:
+            handle = get_doc(attachment["doc"])
+        else:
+            handle = None
+        if handle:
+            handles.append(handle)
+    return handles
+
+
+async def resolve_post(parsed: ParsedPost, video_urls: dict, group_name: str) -> dict:
+    # video_urls заранее получены пачкой через VkResolver, документы скачиваются параллельно (или берутся из кэша)
+    doc_refs = [handle for handle in parsed.attachments if isinstance(handle, DocRef)]
+    images = [doc.url for doc in doc_refs if doc.size > MAX_DOC_SIZE]
+    # Файлы остаются закреплены в кэшах до release_post(), то есть до конца отправки
+    cached = []
+    try:
+        cached += await media_cache.fetch_many([doc.url for doc in doc_refs if doc.size <= MAX_DOC_SIZE])
+        if images:
+            # Большие изображения скачиваются целиком и пережимаются до лимита Telegram
+            cached += await media_cache.fetch_many(images, MEDIA_TRANSFORM_MAX_SOURCE)
+        docs = await media_transformer.fit_many([doc for doc in cached if doc], MAX_DOC_SIZE)
+    except BaseException:
+        media_cache.release(cached)
+        raise
+    videos = [video_urls.get(video.key) or video.fallback_url for video in parsed.attachments if isinstance(video, VideoRef)]
+
+    nodes = parsed.nodes
+    if parsed.repost_url:
+        nodes = add_repost_link(nodes, parsed.repost_url, parsed.item_type, group_name)
+    nodes = add_urls(nodes, videos + handles_of(parsed, Link))
+    logger.info(f"{parsed.item_type.capitalize()} attachments are resolved.")
+    return {
+        "text": render_html(nodes),
+        "discord_text": render_discord(nodes),
+        "photos": handles_of(parsed, Photo),
+        "docs": docs,
+        "tags": parsed.tags,
+        "cached": cached,
+    }
+
+
+def release_post(resolved: dict) -> None:
+    # The post is sent (or dropped): its files may be evicted from the caches again
+    media_transformer.release(resolved["docs"])
+    media_cache.release(resolved["cached"])
+
+
+def handles_of(parsed: ParsedPost, kind: type) -> list:
+    return [handle.url for handle in parsed.attachments if isinstance(handle, kind)]
+
+
+def get_url(attachment: dict, text: str) -> Union[Link, None]:
     url = attachment["link"]["url"]
-    return url if url not in text else None
+    return Link(url) if url not in text else None
 
 
-def get_video(attachment: dict) -> str:
-    owner_id = attachment["video"]["owner_id"]
-    video_id = attachment["video"]["id"]
-    video_type = attachment["video"]["type"]
-    access_key = attachment["video"].get("access_key", "")
-
-    video = get_video_url(VK_TOKEN, REQ_VERSION, owner_id, video_id, access_key)
-    if video:
-        return video
-    elif video_type == "short_video":
-        return f"https://vk.com/clip{owner_id}_{video_id}"
-    else:
-        return f"https://vk.com/video{owner_id}_{video_id}"
+def get_video(attachment: dict) -> VideoRef:
+    video = attachment["video"]
+    return VideoRef(video["owner_id"], video["id"], video.get("type", "video"), video.get("access_key", ""))
 
 
-def get_photo(attachment: dict) -> Union[str, None]:
+def get_photo(attachment: dict) -> Union[Photo, None]:
     sizes = attachment["photo"]["sizes"]
     types = ["w", "z", "y", "x", "r", "q", "p", "o", "m", "s"]
 
@@ -80,37 +113,29 @@ def get_photo(attachment: dict) -> Union[str, None]:
             (item for item in sizes if item["type"] == type_),
             False,
         ):
-            return re.sub(
+            return Photo(re.sub(
                 "&([a-zA-Z]+(_[a-zA-Z]+)+)=([a-zA-Z0-9-_]+)",
                 "",
                 next(
                     (item for item in sizes if item["type"] == type_),
                     False,
                 )["url"],
-            )
+            ))
     else:
         return None
 
 
-def get_doc(doc: dict) -> Union[dict, None]:
-    if "size" in doc and doc["size"] > 50000000:
-        logger.info(f"The document was skipped due to its size exceeding the 50MB limit: {doc['size']=}.")
-        return None
-    else:
-        response = requests.get(doc["url"], allow_redirects=True, timeout=10)
-        # logger.info(doc["url"]) #debug
-        # logger.info(f"redirected-correct url: {response.url}") #debug
-        url_last_part = response.url.split('/')[-1]
-        correct_filename = url_last_part.split('?')[0] if '?' in url_last_part else url_last_part
-        # logger.info(correct_filename) #debug
-
-        with open(f'./temp/{correct_filename}', "wb") as file:
-            file.write(response.content)
+def get_doc(doc: dict) -> Union[DocRef, None]:
+    ext = doc.get("ext", "").lower()
+    if "size" in doc and doc["size"] > MAX_DOC_SIZE:
+        if not (media_transformer.enabled and ext in IMAGE_EXTENSIONS and doc["size"] <= MEDIA_TRANSFORM_MAX_SOURCE):
+            logger.info(f"The document was skipped due to its size exceeding the 50MB limit: {doc['size']=}.")
+            return None
+    return DocRef(doc["url"], doc.get("size", 0), ext)
 
-    return {"title": correct_filename, "url": response.url}
 
-def get_tags(text: str) -> list[str]:
-    tags = re.findall(r"#\w+", text)
+def get_tags(nodes: list) -> list[str]:
+    tags = hashtags(nodes)
     if not tags:
         tags.append('#other')
     return tags
\ No newline at end of file
@@ -0,0 +1,92 @@
+import random
+import time
+from typing import Union
+
+from loguru import logger
+
+
+class SourceSchedule:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval  # learned interval, before backoff and jitter
+        self.rate = 1 / interval  # EWMA of posts per second, the prior is one post per initial interval
+        self.errors = 0
+        self.last_poll: Union[float, None] = None
+        self.next_poll = 0.0
+        self.delay = interval
+
+
+class PollScheduler:
+    # Learns how often every community posts and polls it about once per TARGET_POSTS_PER_POLL posts:
+    # busy walls are polled every min_interval seconds, dormant ones every max_interval.
+    # Empty polls stretch the interval gradually (EMPTY_POLL_BACKOFF per poll), not straight to max_interval.
+    # Jitter keeps hundreds of communities from being polled at the same moment;
+    # a community VK answers with errors backs off exponentially.
+
+    TARGET_POSTS_PER_POLL = 1.0
+    ALPHA = 0.3  # weight of the newest observation in the EWMA
+    EMPTY_POLL_BACKOFF = 1.5
+
+    def __init__(
+        self,
+        initial_interval: float,
+        min_interval: float,
+        max_interval: float,
+        jitter: float,
+        sources: int = 1,
+        requests_per_second: float = 3,
+    ) -> None:
+        # Polls alone must stay under the token's limit: one wall.get per community per min_interval
+        self.min_interval = max(min_interval, sources / requests_per_second)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.initial_interval = min(max(initial_interval, self.min_interval), self.max_interval)
+        self.jitter = jitter
+        self.sources: dict = {}
+
+    def _schedule(self, community) -> SourceSchedule:
+        if community.domain not in self.sources:
+            self.sources[community.domain] = SourceSchedule(self.initial_interval)
+        return self.sources[community.domain]
+
+    def due(self, communities: list, now: Union[float, None] = None) -> list:
+        now = time.monotonic() if now is None else now
+        return [community for community in communities if self._schedule(community).next_poll <= now]
+
+    def seconds_until_next(self, communities: list, now: Union[float, None] = None) -> float:
+        now = time.monotonic() if now is None else now
+        if not communities:
+            return self.min_interval
+        return max(0.0, min(self._schedule(community).next_poll for community in communities) - now)
+
+    def record(self, community, new_posts: Union[int, None], now: Union[float, None] = None) -> float:
+        # new_posts: posts found by this poll, None if VK returned an error
+        now = time.monotonic() if now is None else now
+        schedule = self._schedule(community)
+
+        if new_posts is None:
+            schedule.errors += 1
+            delay = min(self.max_interval, schedule.interval * 2 ** schedule.errors)
+            logger.warning(f"{community.domain}: poll failed {schedule.errors} time(s) in a row, next poll in {delay:.0f}s.")
+        else:
+            schedule.errors = 0
+            if schedule.last_poll is not None and now > schedule.last_poll:
+                observed = new_posts / (now - schedule.last_poll)
+                schedule.rate = self.ALPHA * observed + (1 - self.ALPHA) * schedule.rate
+                if new_posts:
+                    interval = self.TARGET_POSTS_PER_POLL / schedule.rate
+                else:
+                    interval = schedule.interval * self.EMPTY_POLL_BACKOFF
+                schedule.interval = min(max(interval, self.min_interval), self.max_interval)
+            schedule.last_poll = now
+            delay = schedule.interval
+
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        schedule.delay = delay
+        schedule.next_poll = now + delay
+        if new_posts is not None:
+            logger.info(
+                f"{community.domain}: {new_posts} new post(s), {schedule.rate * 3600:.2f} posts/h, next poll in {delay:.0f}s."
+            )
+        return delay
+
+    def stats(self) -> dict:
+        return {domain: round(schedule.delay) for domain, schedule in self.sources.items()}
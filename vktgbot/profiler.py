@@ -0,0 +1,91 @@
+import cProfile
+import os
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+
+from loguru import logger
+
+# Файлы не из кода бота и библиотек, которые засоряют отчёт об аллокациях
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class CycleProfiler:
+    # Profiles every cycle of the main loop: cProfile stats (cycle-<n>.prof, open with
+    # snakeviz / flameprof / gprof2dot) and a tracemalloc report (cycle-<n>.alloc.txt) with the
+    # top allocations grown since the previous cycle. Only the last `keep` cycles are kept.
+    # cProfile sees everything the event loop runs during the cycle, push ingest included.
+
+    def __init__(self, directory: str, keep: int = 50, top: int = 25, frames: int = 10) -> None:
+        self.directory = directory
+        self.keep = max(1, keep)
+        self.top = top
+        self.frames = frames
+        self.cycle = 0
+        self._snapshot = None
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._snapshot = self._take_snapshot()
+        logger.info(f"Profiling every cycle into {self.directory}, keeping the last {self.keep} cycles.")
+
+    @asynccontextmanager
+    async def profile(self):
+        if self._snapshot is None:
+            self.start()
+        self.cycle += 1
+        name = f"cycle-{time.strftime('%Y%m%d-%H%M%S')}-{self.cycle:05d}"
+        profile = cProfile.Profile()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            memory = tracemalloc.get_traced_memory()
+            try:
+                self._write(name, profile, elapsed, memory)
+                self._prune()
+            except OSError as ex:
+                logger.error(f"Could not write the profile of {name}: {ex!r}")
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def _write(self, name: str, profile: cProfile.Profile, elapsed: float, memory: tuple) -> None:
+        profile.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+
+        snapshot = self._take_snapshot()
+        growth = snapshot.compare_to(self._snapshot, "lineno")
+        self._snapshot = snapshot
+        current, peak = memory
+
+        lines = [
+            f"{name}: {elapsed:.3f}s, traced memory {current / 1024**2:.1f} MiB, peak during the cycle {peak / 1024**2:.1f} MiB",
+            "",
+            f"Top {self.top} allocation changes since the previous cycle:",
+        ]
+        lines += [str(stat) for stat in growth[: self.top]]
+        lines += ["", f"Top {self.top} allocations held now:"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[: self.top]]
+        with open(os.path.join(self.directory, f"{name}.alloc.txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        logger.info(f"Profile of {name} is written ({elapsed:.3f}s, peak {peak / 1024**2:.1f} MiB).")
+
+    def _prune(self) -> None:
+        cycles = sorted({entry.split(".", 1)[0] for entry in os.listdir(self.directory) if entry.startswith("cycle-")})
+        for old in cycles[: -self.keep]:
+            for suffix in (".prof", ".alloc.txt"):
+                path = os.path.join(self.directory, old + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
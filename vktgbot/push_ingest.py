@@ -0,0 +1,215 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Union
+
+import aiohttp
+from aiohttp import web
+from loguru import logger
+
+import config
+from api_requests import call_vk_method, get_wall_posts
+from http_session import get_session
+
+LONG_POLL_WAIT = 25
+MAX_BACKOFF = 300
+
+
+class PushState:
+    # Communities whose push channel is up. The rest are polled with wall.get as before.
+
+    def __init__(self) -> None:
+        self.connected: set = set()
+
+    def is_connected(self, community) -> bool:
+        return community.domain in self.connected
+
+    def set_connected(self, community, connected: bool) -> None:
+        if connected and community.domain not in self.connected:
+            logger.info(f"{community.domain}: push channel is up, polling is paused.")
+            self.connected.add(community.domain)
+        elif not connected and community.domain in self.connected:
+            logger.warning(f"{community.domain}: push channel is down, falling back to polling.")
+            self.connected.discard(community.domain)
+
+
+async def resolve_group_ids(communities: list) -> None:
+    # Events carry group_id, so every community needs its numeric id
+    screen_names = []
+    for community in communities:
+        if community.group_id:
+            continue
+        match = re.search(r"^(club|public)(\d+)$", community.domain)
+        if match:
+            community.group_id = int(match.groups()[1])
+        else:
+            screen_names.append(community.domain)
+    if not screen_names:
+        return
+
+    response = await call_vk_method(
+        config.VK_TOKEN, config.REQ_VERSION, "groups.getById", group_ids=",".join(screen_names)
+    )
+    groups = response.get("groups", []) if isinstance(response, dict) else response or []
+    ids = {group["screen_name"]: group["id"] for group in groups}
+    for community in communities:
+        if not community.group_id and community.domain in ids:
+            community.group_id = ids[community.domain]
+        elif not community.group_id:
+            logger.error(f"{community.domain}: group id is unknown, the community stays on polling.")
+
+
+async def fetch_wall_post(community, item) -> Union[dict, None]:
+    # A Callback API request is not trusted beyond its post id: the post itself is read back from VK
+    if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+        return None
+    posts = await get_wall_posts(config.VK_TOKEN, config.REQ_VERSION, community.group_id, [item["id"]])
+    if not posts:
+        logger.warning(f"{community.domain}: post {item['id']} of a Callback API event is not on the wall, skipping.")
+        return None
+    return posts[0]
+
+
+async def run_long_poll(
+    community,
+    state: PushState,
+    on_post: Callable[..., Awaitable],
+    on_connect: Callable[..., Awaitable],
+) -> None:
+    backoff = 1
+    try:
+        while True:
+            server = await call_vk_method(
+                community.group_token, config.REQ_VERSION, "groups.getLongPollServer", group_id=community.group_id
+            )
+            if not server:
+                state.set_connected(community, False)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            try:
+                key, ts = server["key"], server["ts"]
+                state.set_connected(community, True)
+                # Всё, что вышло, пока канала не было, забираем обычным опросом
+                await on_connect(community)
+                while True:
+                    async with get_session().get(
+                        server["server"],
+                        params={"act": "a_check", "key": key, "ts": ts, "wait": LONG_POLL_WAIT},
+                        timeout=aiohttp.ClientTimeout(total=LONG_POLL_WAIT + 10),
+                    ) as response:
+                        data = await response.json(content_type=None)
+
+                    if "failed" in data:
+                        if data["failed"] == 1:  # history is outdated, continue from the new ts
+                            ts = data["ts"]
+                            continue
+                        logger.info(f"{community.domain}: long poll key expired (failed={data['failed']}), reconnecting.")
+                        break
+                    ts = data["ts"]
+                    backoff = 1
+                    for update in data.get("updates", []):
+                        if update["type"] == "wall_post_new":
+                            await on_post(community, update["object"])
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as ex:
+                logger.warning(f"{community.domain}: long poll connection failed: {ex!r}. Retry in {backoff} seconds.")
+                state.set_connected(community, False)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+    finally:
+        # Задача завершилась (отмена или непредвиденная ошибка): сообщество снова опрашивается
+        state.set_connected(community, False)
+
+
+async def run_callback_server(
+    communities: list,
+    state: PushState,
+    on_post: Callable[..., Awaitable],
+    on_connect: Callable[..., Awaitable],
+) -> None:
+    if not config.CALLBACK_SECRET:
+        logger.error("VAR_CALLBACK_SECRET is not set: Callback API server is not started, all communities stay on polling.")
+        return
+    by_group_id = {community.group_id: community for community in communities if community.group_id}
+    tasks: set = set()
+    previous: dict = {}  # domain -> task of the last event, posts are sent in the order VK reported them
+
+    async def on_event(community, item, before: Union[asyncio.Task, None]) -> None:
+        post = await fetch_wall_post(community, item)
+        if before is not None:
+            await asyncio.wait({before})
+        if post is not None:
+            await on_post(community, post)
+
+    async def handle(request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        community = by_group_id.get(data.get("group_id"))
+        if community is None:
+            return web.Response(text="ok")
+        if data.get("secret") != config.CALLBACK_SECRET:
+            logger.warning(f"Callback API request for {community.domain} with a wrong secret.")
+            return web.Response(status=403)
+        if data.get("type") == "confirmation":
+            return web.Response(text=community.callback_confirmation)
+        if data.get("type") == "wall_post_new":
+            # VK ждёт "ok" за несколько секунд, поэтому пост отправляется в фоне (порядок держит блокировка сообщества)
+            task = asyncio.create_task(on_event(community, data.get("object"), previous.get(community.domain)))
+            previous[community.domain] = task
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post(config.CALLBACK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.CALLBACK_HOST, config.CALLBACK_PORT).start()
+    except OSError as ex:
+        logger.error(f"Callback API server could not start: {ex!r}. All communities stay on polling.")
+        await runner.cleanup()
+        return
+
+    logger.info(f"Callback API server is listening on {config.CALLBACK_HOST}:{config.CALLBACK_PORT}{config.CALLBACK_PATH}.")
+    try:
+        for community in by_group_id.values():
+            state.set_connected(community, True)
+            await on_connect(community)
+        # Сервер не знает, настроен ли callback в VK: редкий страховочный опрос находит посты без событий
+        while True:
+            await asyncio.sleep(config.POLL_MAX_INTERVAL)
+            for community in by_group_id.values():
+                missed = await on_connect(community)
+                if missed:
+                    logger.warning(
+                        f"{community.domain}: safety poll found {missed} posts before their Callback API event; "
+                        "if this repeats, check the callback server settings of the community in VK."
+                    )
+    finally:
+        for community in by_group_id.values():
+            state.set_connected(community, False)
+        await runner.cleanup()
+
+
+async def run_push(
+    communities: list,
+    state: PushState,
+    on_post: Callable[..., Awaitable],
+    on_connect: Callable[..., Awaitable],
+) -> None:
+    await resolve_group_ids(communities)
+    if config.INGEST_MODE == "callback":
+        await run_callback_server(communities, state, on_post, on_connect)
+    else:
+        await asyncio.gather(
+            *(
+                run_long_poll(community, state, on_post, on_connect)
+                for community in communities
+                if community.group_id and community.group_token
+            )
+        )
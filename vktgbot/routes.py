@@ -0,0 +1,69 @@
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+import config
+from keyword_filter import KeywordFilter, compile_rules
+
+
+@dataclass
+class Route:
+    # One destination of a community: a Telegram chat or a Discord server (its webhooks are chosen by tag).
+    # tags, whitelist and blacklist narrow down the posts sent there; empty means every post.
+    telegram: str = ""
+    discord: int = 0
+    tags: list = field(default_factory=list)
+    whitelist: list = field(default_factory=list)
+    blacklist: list = field(default_factory=list)
+    whitelist_filter: KeywordFilter = field(init=False, repr=False)
+    blacklist_filter: KeywordFilter = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if bool(self.telegram) == bool(self.discord):
+            raise ValueError(f"A route needs either a Telegram chat or a Discord server: {self}")
+        self.telegram = str(self.telegram) if self.telegram else ""
+        self.discord = int(self.discord)
+        self.tags = [tag.lower() for tag in self.tags]
+        self.whitelist_filter = compile_rules(self.whitelist)
+        self.blacklist_filter = compile_rules(self.blacklist)
+
+    @property
+    def kind(self) -> str:
+        return "telegram" if self.telegram else "discord"
+
+    @property
+    def destination(self) -> str:
+        # Ключ доставки в state store, тот же формат, что и до таблицы маршрутов
+        return f"telegram:{self.telegram}" if self.telegram else f"discord:{self.discord}"
+
+    def accepts(self, text: str, tags: list) -> bool:
+        if self.tags and not any(tag.lower() in self.tags for tag in tags):
+            return False
+        if self.blacklist_filter and self.blacklist_filter.matches(text):
+            return False
+        if self.whitelist_filter and not self.whitelist_filter.matches(text):
+            return False
+        return True
+
+
+def default_routes() -> list:
+    # VAR_ROUTES, or the single VAR_TG_CHANNEL and VAR_DISCORDSERVER_ID of older configs
+    if config.ROUTES:
+        return config.ROUTES
+    routes = []
+    if config.TG_CHANNEL:
+        routes.append({"telegram": config.TG_CHANNEL})
+    if config.DISCORDSERVER_ID != 0:
+        routes.append({"discord": config.DISCORDSERVER_ID})
+    return routes
+
+
+def compile_routes(entries: list) -> list[Route]:
+    routes = []
+    for entry in entries:
+        route = Route(**entry)
+        if route.destination in (r.destination for r in routes):
+            logger.warning(f"Destination {route.destination} is listed twice, the duplicate is ignored.")
+            continue
+        routes.append(route)
+    return routes
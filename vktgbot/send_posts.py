@@ -1,26 +1,69 @@
 import asyncio
-import discord
-from discord.ext import commands
 import aiohttp
 import io
 import json
+from typing import Awaitable, Callable
 
 from aiogram import Bot, types
 from aiogram.utils import exceptions
 from loguru import logger
 
-from tools import (split_text, 
-                   clearTextExcludeLinks,
-                   createTGlink,
-                   convertToSendingFormat,
+from config import DISCORD_UPLOAD_LIMIT
+
+from discord_ratelimit import get_bucket
+from discord_service import get_discord_service
+from http_session import get_session
+from media_cache import media_cache
+from media_transform import media_transformer
+from metrics import flood_waits, posts_sent, retries, stage_seconds
+from routes import Route
+from state_store import state_store
+from tg_file_cache import document_key, file_id_of, photo_key, tg_file_cache
+from tg_scheduler import tg_scheduler
+from webhook_directory import WebhookDirectory
+from text_packer import CAPTION_LIMIT, MESSAGE_LIMIT, pack_html, visible_length
+from tools import (createVKlink,
+                   load_attachments,
                    )
 
+DISCORD_FILES_PER_MESSAGE = 10
 
-async def send_post(bot: Bot, tg_channel: str, text: str, photos: list, docs: list, tags: list, discord_token: str, discord_server_id: int, num_tries: int = 0) -> None:
+
+# delivery_key = (сообщество, id поста, часть поста): уже доставленное при повторном запуске не отправляется
+# Все маршруты доставляются одновременно и независимо: свои повторы и свой статус у каждого
+async def send_post(bot: Bot, routes: list, text: str, photos: list, docs: list, tags: list, discord_token: str, delivery_key: tuple, discord_text: str = "", post_url: str = "") -> None:
+    # Discord ссылается на пост ВКонтакте, а не на сообщение в Telegram, и не ждёт его отправки
+    if post_url:
+        discord_text = createVKlink(post_url, discord_text)
+    await asyncio.gather(
+        *(deliver(bot, route, text, photos, docs, tags, discord_token, delivery_key, discord_text) for route in routes)
+    )
+
+
+async def deliver(bot: Bot, route: Route, text: str, photos: list, docs: list, tags: list, discord_token: str, delivery_key: tuple, discord_text: str) -> None:
+    if state_store.is_delivered(*delivery_key, route.destination):
+        logger.info(f"Post was already sent to {route.destination}.")
+        return
+    message_id = None
+    try:
+        with stage_seconds.time(route.kind):
+            if route.telegram:
+                delivered, message_id = await send_to_telegram(bot, route.telegram, text, photos, docs)
+            else:
+                delivered = await send_to_discord(discord_token, route.discord, discord_text, photos, docs, tags)
+    except Exception as ex:
+        logger.exception(f"Post was not sent to {route.destination}: {ex!r}")
+        delivered = False
+    if delivered:
+        posts_sent.inc(route.kind)
+    state_store.mark(*delivery_key, route.destination, "delivered" if delivered else "failed", message_id)
+
+
+async def send_to_telegram(bot: Bot, tg_channel: str, text: str, photos: list, docs: list, num_tries: int = 0) -> tuple:
     num_tries += 1
     if num_tries > 3:
         logger.error("Post was not sent to Telegram. Too many tries.")
-        return
+        return False, None
     try:
         if len(photos) == 0 and not docs:
             message = await send_text_post(bot, tg_channel, text)
@@ -30,87 +73,153 @@ async def send_post(bot: Bot, tg_channel: str, text: str, photos: list, docs: li
             message = await send_photos_post(bot, tg_channel, text, photos)
         elif docs:
             message = await send_docs_post(bot, tg_channel, text, docs)
-
-        # проверка объявленности переменной, если нет то не слать в дискорд
-        if (discord_server_id != 0): 
-            # Формируем ссылку на сообщение
-            text = createTGlink(tg_channel, message, text)
-            # Discord отправка (пример — отправляем текст и прикрепления)
-            await send_to_discord(discord_token, discord_server_id, text, photos, docs, tags)
+        if isinstance(message, list):
+            message = message[0] if message else None  # У альбома берем первое сообщение
+        return True, message.message_id if message else None
 
     except exceptions.RetryAfter as ex:
         logger.warning(f"Flood limit is exceeded. Sleep {ex.timeout} seconds. Try: {num_tries}")
-        await asyncio.sleep(ex.timeout)
-        await send_post(bot, tg_channel, text, photos, docs, num_tries)
+        flood_waits.inc("telegram")
+        retries.inc("telegram")
+        # Планировщик придержит этот и все остальные сообщения в чат на ex.timeout секунд
+        tg_scheduler.flood_wait(tg_channel, ex.timeout)
+        return await send_to_telegram(bot, tg_channel, text, photos, docs, num_tries)
     except exceptions.BadRequest as ex:
-        logger.warning(f"Bad request. Wait 60 seconds. Try: {num_tries}. {ex}")
-        await asyncio.sleep(60)
-        await send_post(bot, tg_channel, text, photos, docs, num_tries)
+        # Очередь не стоит: короткая пауза, растущая с каждой попыткой
+        logger.warning(f"Bad request. Wait {2 ** num_tries} seconds. Try: {num_tries}. {ex}")
+        retries.inc("telegram")
+        await asyncio.sleep(2 ** num_tries)
+        return await send_to_telegram(bot, tg_channel, text, photos, docs, num_tries)
 
 
 async def send_text_post(bot: Bot, tg_channel: str, text: str) -> None:
     if not text:
         return
 
-    if len(text) < 4096:
-        message = await bot.send_message(tg_channel, text, parse_mode=types.ParseMode.HTML)
-    else:
-        text_parts = split_text(text, 4084)
-        prepared_text_parts = (
-            [text_parts[0] + " (...)"]
-            + ["(...) " + part + " (...)" for part in text_parts[1:-1]]
-            + ["(...) " + text_parts[-1]]
-        )
-
-        for part in prepared_text_parts:
-            message = await bot.send_message(tg_channel, part, parse_mode=types.ParseMode.HTML)
-            await asyncio.sleep(0.5)
+    # Первое сообщение поста возвращается для ссылки из Discord
+    message = None
+    for part in pack_html(text, MESSAGE_LIMIT, MESSAGE_LIMIT):
+        sent = await tg_scheduler.send(tg_channel, bot.send_message, tg_channel, part, parse_mode=types.ParseMode.HTML)
+        message = message or sent
     logger.info("Text post sent to Telegram.")
     return message
 
 
+async def send_text_parts(bot: Bot, tg_channel: str, parts: list) -> None:
+    # Продолжение подписи отдельными сообщениями
+    for part in parts:
+        await tg_scheduler.send(tg_channel, bot.send_message, tg_channel, part, parse_mode=types.ParseMode.HTML)
+
+
 async def send_photo_post(bot: Bot, tg_channel: str, text: str, photos: list) -> None:
-    if len(text) <= 1024:
-        message = await bot.send_photo(tg_channel, photos[0], text, parse_mode=types.ParseMode.HTML)
+    text_length = visible_length(text)
+    if text_length <= CAPTION_LIMIT:
+        message = await send_cached(
+            bot, tg_channel, bot.send_photo, photo_key(photos[0]), photos[0], caption=text, parse_mode=types.ParseMode.HTML
+        )
         logger.info("Text post (<=1024) with photo sent to Telegram.")
-    else:
-        prepared_text = f'<a href="{photos[0]}"> </a>{text}'
-        if len(prepared_text) <= 4096:
-            message = await bot.send_message(tg_channel, prepared_text, parse_mode=types.ParseMode.HTML)
-        else:
-            await send_text_post(bot, tg_channel, text)
-            message = await bot.send_photo(tg_channel, photos[0])
+    elif text_length < MESSAGE_LIMIT:
+        # Одно сообщение: фото показывается превью невидимой ссылки (её пробел тоже считается в лимит)
+        message = await tg_scheduler.send(
+            tg_channel, bot.send_message, tg_channel, f'<a href="{photos[0]}"> </a>{text}', parse_mode=types.ParseMode.HTML
+        )
         logger.info("Text post (>1024) with photo sent to Telegram.")
+    else:
+        parts = pack_html(text, CAPTION_LIMIT, MESSAGE_LIMIT)
+        caption, parts = (parts[0], parts[1:]) if parts else (None, [])
+        message = await send_cached(
+            bot, tg_channel, bot.send_photo, photo_key(photos[0]), photos[0], caption=caption, parse_mode=types.ParseMode.HTML
+        )
+        await send_text_parts(bot, tg_channel, parts)
+        logger.info(f"Text post (>4096) with photo sent to Telegram in {len(parts) + 1} messages.")
     return message
 
 
 async def send_photos_post(bot: Bot, tg_channel: str, text: str, photos: list) -> None:
+    # Подпись альбома заполняется первой, остаток текста уходит следом сообщениями по 4096
+    parts = pack_html(text, CAPTION_LIMIT, MESSAGE_LIMIT) if text else []
+    keys = [photo_key(photo) for photo in photos]
+    file_ids = [tg_file_cache.get(bot.id, key) for key in keys]
+    try:
+        message = await send_media_group(bot, tg_channel, [file_id or photo for file_id, photo in zip(file_ids, photos)], parts)
+    except exceptions.BadRequest as ex:
+        if not any(file_ids) or "file" not in str(ex).lower():
+            raise
+        for key, file_id in zip(keys, file_ids):
+            if file_id:
+                tg_file_cache.forget(bot.id, key)
+        file_ids = [None] * len(photos)
+        message = await send_media_group(bot, tg_channel, photos, parts)
+    for key, file_id, sent in zip(keys, file_ids, message or []):
+        if not file_id:
+            tg_file_cache.put(bot.id, key, file_id_of(sent))
+    await send_text_parts(bot, tg_channel, parts[1:])
+    logger.info("Text post with photos sent to Telegram.")
+    return message
+
+
+async def send_media_group(bot: Bot, tg_channel: str, photos: list, parts: list) -> list:
     media = types.MediaGroup()
     for photo in photos:
         media.attach_photo(types.InputMediaPhoto(photo))
-
-    if (len(text) > 0) and (len(text) <= 1024):
-        media.media[0].caption = text
+    if parts:
+        media.media[0].caption = parts[0]
         media.media[0].parse_mode = types.ParseMode.HTML
-    elif len(text) > 1024:
-        await send_text_post(bot, tg_channel, text)
-    message = await bot.send_media_group(tg_channel, media)
-    logger.info("Text post with photos sent to Telegram.")
-    return message
+    return await tg_scheduler.send(tg_channel, bot.send_media_group, tg_channel, media, cost=len(media.media))
 
 
-async def send_docs_post(bot: Bot, tg_channel: str, text: str, docs: list) -> None:
-    for doc in docs:
+async def send_cached(bot: Bot, tg_channel: str, method, key: str, upload, size: int = 0, upload_extra: Callable[[], Awaitable[dict]] = None, **kwargs):
+    # Telegram уже видел этот файл: отправляется его file_id, загрузки нет.
+    # upload_extra() даёт дополнительные параметры загрузки и вызывается только при загрузке
+    file_id = await tg_file_cache.acquire(bot.id, key, size)
+    if file_id:
         try:
-            # Открываем файл из временной директории
-            with open(f"./temp/{doc['title']}", "rb") as file:
-                # Отправляем файл с текстом
-                message = await bot.send_document(chat_id=tg_channel, document=file, caption=text)
-                logger.info(f"Документ {doc['title']} отправлен в Telegram.")
-            return message
-        except Exception as e:
-            logger.error(f"Ошибка при отправке документа {doc['title']}: {e}")
+            return await tg_scheduler.send(tg_channel, method, tg_channel, file_id, **kwargs)
+        except exceptions.BadRequest as ex:
+            if "file" not in str(ex).lower():
+                raise
+            tg_file_cache.forget(bot.id, key)
+    try:
+        extra = await upload_extra() if upload_extra else {}
+        message = await tg_scheduler.send(tg_channel, method, tg_channel, upload, **kwargs, **extra)
+        tg_file_cache.put(bot.id, key, file_id_of(message), size)
+    finally:
+        tg_file_cache.release(bot.id, key)
+    return message
+
 
+async def send_docs_post(bot: Bot, tg_channel: str, text: str, docs: list) -> None:
+    # Ошибка отправки не глотается: deliver() отметит маршрут как failed, а не delivered
+    # pack_html может вернуть [] (текст из одних пробелов): тогда без подписи, как в send_photos_post
+    parts = pack_html(text, CAPTION_LIMIT, MESSAGE_LIMIT) if text else []
+    caption, parts = (parts[0], parts[1:]) if parts else (None, [])
+    doc = docs[0]
+
+    async def thumbnail() -> dict:
+        # Превью для изображений-документов (из пула процессов, кэшируется по хэшу), только если файл загружается
+        thumb = await media_transformer.thumbnail(doc)
+        if not thumb:
+            return {}
+        with open(thumb, "rb") as thumb_file:
+            return {"thumb": types.InputFile(io.BytesIO(thumb_file.read()), filename="thumb.jpg")}
+
+    # Открываем файл из кэша медиа
+    with open(doc['path'], "rb") as file:
+        # Отправляем файл с текстом
+        message = await send_cached(
+            bot,
+            tg_channel,
+            bot.send_document,
+            document_key(doc),
+            types.InputFile(file, filename=doc['title']),
+            doc['size'],
+            thumbnail,
+            caption=caption,
+            parse_mode=types.ParseMode.HTML,
+        )
+        logger.info(f"Документ {doc['title']} отправлен в Telegram.")
+    await send_text_parts(bot, tg_channel, parts)
+    return message
 
 
 async def send_to_discord(
@@ -120,117 +229,127 @@ async def send_to_discord(
     photos: list,
     docs: list,
     tags: list,
-) -> None:
-    intents = discord.Intents.default()
-    discord_bot = commands.Bot(command_prefix="!", intents=intents)
-    text = clearTextExcludeLinks(text) # Не отправляем текст в дискорд кроме ссылок
-
-    @discord_bot.event
-    async def on_ready():
-        try:
-            # logger.info("Бот подключён!")
-
-            # Получаем словарь вебхуков
-            webhooks_dict = await get_webhooks(discord_bot, discord_server_id)
-
-            for tag in tags:
-                webhook = webhooks_dict.get(tag)
-
-                if not webhook and '#other' in webhooks_dict:
-                    if '#other' in tags:
-                        continue
-                    webhook = webhooks_dict['#other']  # Используем вебхук для "других" сообщений
-
-                if webhook:
-                    files = convertToSendingFormat(photos, docs) 
-                    await send_discord_post( photos, text, files, webhook, discord_bot )
-                else:
-                    logger.warning(f"Вебхук для тега {tag} не найден, сообщение пропущено.")
-        finally:
-            await discord_bot.close()
-
-    await discord_bot.start(discord_token)
-
-# async def download_file(url: str) -> tuple[io.BytesIO, str]:
-#     """Скачивает файл по URL и возвращает объект BytesIO и исправленное имя файла."""
-#     async with aiohttp.ClientSession() as session:
-#         async with session.get(url) as response:
-#             if response.status == 200:
-#                 data = await response.read()
-#                 # logger.info(f"{url} url")
-#                 original_filename = url.split("/")[-1]
-#                 fixed_filename = fix_filename(original_filename)
-#                 return io.BytesIO(data), fixed_filename
-#             else:
-#                 raise ValueError(f"Не удалось скачать файл: {url} (status: {response.status})")
-            
-async def get_webhooks(discord_bot, server_id, num_tries: int = 0) -> dict:
-    num_tries += 1
-    webhooks_dict = {}
+) -> bool:
+    discord_service = get_discord_service(discord_token)
+    webhooks = discord_service.webhooks(discord_server_id)
+    # Шлюз нужен только для построения справочника вебхуков, сами посты уходят через вебхуки
+    if webhooks.is_stale and await discord_service.start():
+        await webhooks.ensure(discord_service.bot)
+    if not webhooks.webhooks:
+        logger.error(f"Post was not sent to Discord server {discord_server_id}. No webhooks are known.")
+        return False
+    return await discord_service.run(deliver_to_discord(webhooks, text, photos, docs, tags))
+
+
+async def deliver_to_discord(webhooks: WebhookDirectory, text: str, photos: list, docs: list, tags: list) -> bool:
+    # Один вебхук получает пост один раз, даже если к нему ведут несколько тегов
+    targets = {}
+    for tag in tags:
+        webhook = webhooks.get(tag)
+
+        if not webhook and '#other' in webhooks:
+            if '#other' in tags:
+                continue
+            webhook = webhooks.get('#other')  # Используем вебхук для "других" сообщений
+
+        if webhook:
+            targets.setdefault(webhook['url'], webhook)
+        else:
+            logger.warning(f"Вебхук для тега {tag} не найден, сообщение пропущено.")
+    if not targets:
+        return True
 
-    if num_tries > 3:
-        logger.error("Post was not sent to Discord. Too many tries.")
-        return
+    # Фото скачиваются один раз на пост (из кэша), файлы читаются с диска один раз на все вебхуки
+    cached = await media_cache.fetch_many(photos)
+    fitted = []
     try:
-        for guild in discord_bot.guilds:
-            if server_id == guild.id:
-                # logger.info(f"Сервер: {guild.name} (ID: {guild.id})")
-                for channel in guild.text_channels:
-                    try:
-                        webhooks = await channel.webhooks()
-                        for webhook in webhooks:
-                            webhooks_dict[webhook.name] = {'channel_id' : channel.id, 'url' : webhook.url}  # Добавляем в словарь
-                            # logger.info(f"Вебхук добавлен: {webhook.name} -> {webhook.url}") # debug
-                    except discord.Forbidden:
-                        logger.warning(f"Нет доступа к вебхукам канала {channel.name}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при получении вебхуков для канала {channel.name}: {e}")
-        logger.info(f"Сервер: {guild.name} (ID: {guild.id}), Словарь вебхуков: {webhooks_dict}")
-        return webhooks_dict
-    except Exception as e:
-        logger.warning(f"{e}. Sleep {10} seconds. Try: {num_tries}")
-        await asyncio.sleep(10)
-        await get_webhooks(discord_bot, server_id)
-
-# Из за ограничения discord, через хттп-вебхуки сервером принимается только первый файл, остальные файлы в этом запросе будут проигнорированы
-async def send_discord_aiohttpRequest(text, files, webhook_url):
+        # Изображения больше лимита Discord пережимаются (в пуле процессов), а не теряются
+        fitted += await media_transformer.fit_many([doc for doc in cached if doc], DISCORD_UPLOAD_LIMIT)
+        photo_count = len(fitted)
+        fitted += await media_transformer.fit_many(docs, DISCORD_UPLOAD_LIMIT)
+        attachments = await asyncio.to_thread(load_attachments, fitted[:photo_count], fitted[photo_count:])
+    finally:
+        media_transformer.release(fitted)
+        media_cache.release(cached)
+    batches = batch_attachments(attachments, DISCORD_FILES_PER_MESSAGE, DISCORD_UPLOAD_LIMIT)
+
+    results = await asyncio.gather(*(send_discord_post(text, batches, webhook, webhooks) for webhook in targets.values()))
+    return all(results)
+
+
+# Discord принимает до 10 файлов и не больше DISCORD_UPLOAD_LIMIT байт на сообщение:
+# вложения раскладываются по порядку в столько сообщений, сколько нужно
+def batch_attachments(attachments: list, max_files: int, max_bytes: int) -> list:
+    batches = [[]]
+    size = 0
+    for file_name, file_data in attachments:
+        if len(file_data) > max_bytes:
+            logger.warning(f"Файл {file_name} ({len(file_data)} байт) больше лимита Discord и не будет отправлен.")
+            continue
+        if batches[-1] and (len(batches[-1]) >= max_files or size + len(file_data) > max_bytes):
+            batches.append([])
+            size = 0
+        batches[-1].append((file_name, file_data))
+        size += len(file_data)
+    return batches
+
+
+async def send_discord_aiohttpRequest(text, attachments, webhook_url, num_tries: int = 0):
+    num_tries += 1
     logger.info(f"Отправляем сообщение в вебхук: {webhook_url}")
-    payload = { "content": text }
-
-    async with aiohttp.ClientSession() as session:
-        form_data = aiohttp.FormData()
-        form_data.add_field('payload_json', json.dumps(payload))
-        for file_name, file_data in files:
-            form_data.add_field(file_name, file_data[1], filename=file_data[0])
-        
-        async with session.post(webhook_url, data=form_data) as response:
-            if response.status == 200:
+    payload = {
+        "content": text,
+        "attachments": [{"id": n, "filename": file_name} for n, (file_name, _) in enumerate(attachments)],
+    }
+
+    # FormData одноразовая, но байты файлов в ней не копируются
+    form_data = aiohttp.FormData()
+    form_data.add_field('payload_json', json.dumps(payload))
+    for n, (file_name, file_data) in enumerate(attachments):
+        form_data.add_field(f'files[{n}]', file_data, filename=file_name)
+
+    async with get_bucket(webhook_url) as bucket:
+        async with get_session().post(webhook_url, data=form_data) as response:
+            bucket.update(response.headers)
+            if response.status == 429:
+                retry_after = float((await response.json(content_type=None)).get("retry_after", 1))
+                bucket.block(retry_after)
+                flood_waits.inc("discord")
+            elif response.status in (200, 204):
                 logger.info(f"Сообщение успешно отправлено в вебхук {webhook_url}")
             else:
                 logger.error(f"Ошибка отправки в вебхук {webhook_url}: {response.status}")
+            status = response.status
 
+    if status == 429:
+        logger.warning(f"Discord rate limit for webhook {webhook_url}. Retry after {retry_after} seconds. Try: {num_tries}")
+        if num_tries < 3:
+            retries.inc("discord")
+            return await send_discord_aiohttpRequest(text, attachments, webhook_url, num_tries)
+    return status
 
-# Отправка сообщения из под бота в канале
-async def send_discord_channel(text, files, channel_id, discord_bot):
-    logger.info(f"Отправляем сообщение в канал: {channel_id}")
 
-    channel = discord_bot.get_channel(channel_id)
-    await channel.send(content=text, files=files)
-    logger.info(f"Message sent to channel {channel.name} in Discord")
+# Отправка поста: текст с первой пачкой вложений, остальные пачки следом
+async def send_discord_post(text, batches, webhook, webhooks: WebhookDirectory) -> bool:
+    for number, batch in enumerate(batches):
+        if not await send_discord_message(text if number == 0 else "", batch, webhook, webhooks):
+            return False
+    return True
 
 
-# Отправка сообщения
-async def send_discord_post( photos, text, files, webhook, discord_bot, num_tries: int = 0):
+async def send_discord_message(text, attachments, webhook, webhooks: WebhookDirectory, num_tries: int = 0) -> bool:
     num_tries += 1
     if num_tries > 3:
         logger.error("Post was not sent to Discord. Too many tries.")
-        return
+        return False
     try:
-        if len(photos) > 1 :
-            await send_discord_channel(text, files, webhook['channel_id'], discord_bot)
-        else:
-            await send_discord_aiohttpRequest(text, files, webhook['url'])
+        status = await send_discord_aiohttpRequest(text, attachments, webhook['url'])
+        if status in (401, 404):
+            # Вебхук удалён или сброшен — убираем только его из справочника
+            webhooks.invalidate_url(webhook['url'])
+        return status in (200, 204)
     except Exception as e:
         logger.warning(f"{e}. Sleep {30} seconds. Try: {num_tries}")
+        retries.inc("discord")
         await asyncio.sleep(30)
-        await send_discord_post(photos, text, files, webhook, discord_bot, num_tries)
\ No newline at end of file
+        return await send_discord_message(text, attachments, webhook, webhooks, num_tries)
@@ -1,102 +1,268 @@
-from typing import Union
+import asyncio
+import time
+from typing import Callable, Union
 
-import discord
-from discord.ext import commands
-from aiogram import Bot, Dispatcher
-from aiogram.utils import executor
+from aiogram import Bot
 from loguru import logger
 
 import config
-from api_requests import get_data_from_vk, get_group_name
-from last_id import read_id, write_id
-from parse_posts import parse_post
+from api_requests import get_data_from_vk, get_data_from_vk_many, get_newest_post_id, get_wall_posts, iter_new_posts
+from communities import Community, load_communities
+from parse_posts import parse_post, release_post, resolve_post
+from push_ingest import resolve_group_ids
 from send_posts import send_post
-from tools import blacklist_check, prepare_temp_folder, whitelist_check
-
-# Асинхронный клиент для Discord
-# discord_client = discord.Client(intents=discord.Intents.default())
-# intents = discord.Intents.default()
-# discord_bot = commands.Bot(command_prefix="!", intents=intents)
-
-def start_script(firstStartBool):
-    bot = Bot(token=config.TG_BOT_TOKEN)
-    dp = Dispatcher(bot)
-
-    items: Union[dict, None] = get_data_from_vk(
-        config.VK_TOKEN,
-        config.REQ_VERSION,
-        config.VK_DOMAIN,
-        config.REQ_FILTER,
-        config.REQ_COUNT,
+from state_store import state_store
+from media_cache import media_cache
+from media_transform import media_transformer
+from metrics import posts_skipped, stage_seconds
+from tg_file_cache import tg_file_cache
+from tg_scheduler import tg_scheduler
+from tools import blacklist_check, whitelist_check
+from vk_resolver import VkResolver
+
+CATCHUP_CHUNK_SIZE = 100
+DELIVERIES_RETENTION = 30 * 24 * 60 * 60
+# Столько раз пробуем доставить пост в одно место назначения, включая первую попытку
+DELIVERY_ATTEMPTS = 5
+
+communities = load_communities()
+# Кэш названий групп живёт между циклами
+vk_resolver = VkResolver(config.VK_TOKEN, config.REQ_VERSION, config.GROUP_NAMES_CACHE_SIZE)
+# Опрос и push-события одного сообщества не должны идти одновременно
+community_locks: dict = {}
+
+
+def community_lock(community: Community) -> asyncio.Lock:
+    if community.domain not in community_locks:
+        community_locks[community.domain] = asyncio.Lock()
+    return community_locks[community.domain]
+
+
+async def start_script(bot: Bot, selected: Union[list, None] = None) -> dict:
+    # selected: communities to poll, all of them by default (push mode polls only disconnected ones)
+    # Returns {domain: number of new posts}, None for a community VK answered with an error
+    selected = communities if selected is None else selected
+    if not selected:
+        return {}
+    first_pages = await get_data_from_vk_many(config.VK_TOKEN, config.REQ_VERSION, selected)
+    results = {}
+    for community in selected:
+        results[community.domain] = await process_community(bot, community, first_pages[community.domain])
+    state_store.prune(time.time() - DELIVERIES_RETENTION)
+    return results
+
+
+async def catch_up_community(bot: Bot, community: Community) -> Union[int, None]:
+    # Returns the number of new posts, None for a VK error
+    first_page = await get_data_from_vk(
+        config.VK_TOKEN, config.REQ_VERSION, community.domain, community.req_filter, community.req_count
     )
-    if not items:
+    return await process_community(bot, community, first_page)
+
+
+async def handle_wall_post(bot: Bot, community: Community, item: dict) -> None:
+    # wall_post_new from Long Poll or Callback API
+    if not matches_req_filter(community, item):
+        return
+    async with community_lock(community):
+        last_known_id = state_store.read_cursor(community.domain)
+        if last_known_id and item["id"] <= last_known_id:
+            logger.info(f"{community.domain}: post {item['id']} was already processed, skipping the event.")
+            return
+        await send_chunk(bot, community, [item])
+
+
+def matches_req_filter(community: Community, item: dict) -> bool:
+    post_type = {"suggests": "suggest", "postponed": "postpone"}.get(community.req_filter, "post")
+    if item.get("post_type", "post") != post_type:
+        return False
+    if community.req_filter == "owner":
+        return item.get("from_id") == item.get("owner_id")
+    if community.req_filter == "others":
+        return item.get("from_id") != item.get("owner_id")
+    return True
+
+
+async def process_community(bot: Bot, community: Community, first_page: Union[dict, None]) -> Union[int, None]:
+    if not first_page:
+        return None
+    async with community_lock(community):
+        return await _process_community(bot, community, first_page)
+
+
+async def _process_community(bot: Bot, community: Community, first_page: dict) -> int:
+
+    last_known_id = state_store.read_cursor(community.domain)
+    if not last_known_id: # starts on last post (the wall is never caught up from its very beginning)
+        last_known_id = get_newest_post_id(first_page)
+        if last_known_id is not None:
+            state_store.write_cursor(community.domain, last_known_id)
+            logger.info(f"{community.domain}: last ID on wall: {last_known_id}")
+        return 0
+
+    logger.info(f"{community.domain}: last known ID: {last_known_id}")
+
+    # Посты приходят от старых к новым и отправляются пачками, курсор пишется после каждого поста
+    chunk = []
+    new_posts = 0
+    async for item in iter_new_posts(config.VK_TOKEN, config.REQ_VERSION, community, last_known_id, first_page):
+        chunk.append(item)
+        new_posts += 1
+        if len(chunk) >= CATCHUP_CHUNK_SIZE:
+            await send_chunk(bot, community, chunk)
+            chunk = []
+    if chunk:
+        await send_chunk(bot, community, chunk)
+    await retry_failed(bot, community)
+    return new_posts
+
+
+async def retry_failed(bot: Bot, community: Community) -> None:
+    # Курсор уходит дальше поста, даже если одно из мест назначения не приняло его:
+    # такие пары (пост, место назначения) отправляются заново в следующих циклах, не больше DELIVERY_ATTEMPTS раз
+    post_ids = state_store.failed_posts(community.domain, DELIVERY_ATTEMPTS)
+    if not post_ids:
+        return
+    await resolve_group_ids([community])
+    if not community.group_id:
         return
+    started = time.time()
+    items = await get_wall_posts(config.VK_TOKEN, config.REQ_VERSION, community.group_id, post_ids)
+    if items is None:
+        return
+    missing = set(post_ids) - {item["id"] for item in items}
+    if missing:
+        logger.warning(f"{community.domain}: posts {sorted(missing)} are not on the wall anymore, skipping their retry.")
+    if items:
+        logger.info(f"{community.domain}: retrying failed deliveries of {len(items)} posts.")
+        # Уже доставленные части и маршруты пропускаются, курсор не трогаем
+        await send_chunk(bot, community, sorted(items, key=lambda item: item["id"]), checkpoint=lambda post_id: None)
+    state_store.count_skipped_retries(community.domain, post_ids, started)
+
+
+async def send_chunk(
+    bot: Bot,
+    community: Community,
+    items: list,
+    lookahead: int = 1,
+    checkpoint: Union[Callable[[int], None], None] = None,
+) -> None:
+    # checkpoint(post_id) is called after every post, by default it moves the cursor of the community
+    if checkpoint is None:
+        checkpoint = lambda post_id: state_store.write_cursor(community.domain, post_id)  # noqa: E731
+    new_items = {item["id"]: new_item for item in items if (new_item := filter_item(community, item))}
+    # Сначала разбор всей пачки без сети, затем видео и названия групп для неё одним запросом
+    parsed_items = {item_id: parse_item(item) for item_id, item in new_items.items()}
+    video_urls = await vk_resolver.resolve([parsed for parts in parsed_items.values() for parsed in parts.values()])
+    # Вложения следующих постов разрешаются, пока отправляется текущий (не дальше lookahead постов вперёд)
+    order = list(new_items)
+    resolving: dict = {}
+
+    def start_resolving(position: int) -> None:
+        if position < len(order) and order[position] not in resolving:
+            item_id = order[position]
+            resolving[item_id] = asyncio.create_task(
+                resolve_item(community, new_items[item_id], parsed_items[item_id], video_urls)
+            )
+
+    position = 0
+    try:
+        for item in items:
+            if item["id"] in new_items:
+                for ahead in range(lookahead + 1):
+                    start_resolving(position + ahead)
+                position += 1
+                resolved = await resolving.pop(item["id"])
+                try:
+                    await send_item(bot, community, new_items[item["id"]], resolved)
+                finally:
+                    release_item(resolved)
+            checkpoint(item["id"])
+    finally:
+        for task in resolving.values():
+            if task.done() and not task.cancelled() and not task.exception():
+                release_item(task.result())
+            task.cancel()
+    logger.info(f"Media cache: {media_cache.stats()}")
+    logger.info(f"Telegram queue: {tg_scheduler.stats()}")
+    logger.info(f"Telegram file cache: {tg_file_cache.stats()}")
+    if media_transformer.enabled:
+        logger.info(f"Media transform: {media_transformer.stats()}")
+
+
+def parse_item(item: dict) -> dict:
+    item_parts = {"post": item}
+    if "copy_history" in item:
+        item_parts["repost"] = item["copy_history"][0]
+        logger.info(f"Detected repost in the post {item['id']}.")
+    repost_exists = len(item_parts) > 1
+    with stage_seconds.time("parse"):
+        return {item_part: parse_post(part, repost_exists, item_part) for item_part, part in item_parts.items()}
+
+
+def filter_item(community: Community, item: dict) -> Union[dict, None]:
+    logger.info(f"Working with post with ID: {item['id']}.")
+    if blacklist_check(community.blacklist_filter, item["text"]):
+        posts_skipped.inc("blacklist")
+        return None
+    if whitelist_check(community.whitelist_filter, item["text"]):
+        posts_skipped.inc("whitelist")
+        return None
+    if community.skip_ads_posts and item["marked_as_ads"]:
+        logger.info("Post was skipped as an advertisement.")
+        posts_skipped.inc("ads")
+        return None
+    if community.skip_copyrighted_post and "copyright" in item:
+        logger.info("Post was skipped as an copyrighted post.")
+        posts_skipped.inc("copyright")
+        return None
+    if community.skip_reposts and "copy_history" in item:
+        item = {key: value for key, value in item.items() if key != "copy_history"}
+    return item
+
+
+async def resolve_item(community: Community, item: dict, parsed_parts: dict, video_urls: dict) -> dict:
+    resolved = {}
+    for item_part, parsed in parsed_parts.items():
+        delivery_key = (community.domain, item["id"], item_part)
+        routes = routes_for(community, item, parsed.tags)
+        if all(state_store.is_delivered(*delivery_key, route.destination) for route in routes):
+            logger.info(f"The {item_part} of post {item['id']} was already delivered, skipping.")
+            continue
+        group_name = vk_resolver.group_name(parsed.repost_owner_id) if parsed.repost_owner_id else ""
+        try:
+            resolved[item_part] = await resolve_post(parsed, video_urls, group_name)
+        except BaseException:
+            release_item(resolved)
+            raise
+    return resolved
+
+
+def release_item(resolved_parts: dict) -> None:
+    for resolved in resolved_parts.values():
+        release_post(resolved)
+
+
+async def send_item(bot: Bot, community: Community, item: dict, resolved_parts: dict) -> None:
+    post_url = f"https://vk.com/wall{item['owner_id']}_{item['id']}"
+    for item_part, parsed_post in resolved_parts.items():
+        delivery_key = (community.domain, item["id"], item_part)
+        logger.info(f"Starting sending of the {item_part} ({community.domain})")
+
+        await send_post(
+            bot,
+            routes_for(community, item, parsed_post["tags"]),
+            parsed_post["text"],
+            parsed_post["photos"],
+            parsed_post["docs"],
+            parsed_post["tags"],
+            config.DISCORDBOT_TOKEN,
+            delivery_key,
+            parsed_post["discord_text"],
+            post_url,
+        )
+
 
-    if "is_pinned" in items[0]:
-        items = items[1:]
-    logger.info(f"Got a few posts with IDs: {items[-1]['id']} - {items[0]['id']}.")
-
-    new_last_id: int = items[0]["id"]
-    
-    if firstStartBool: # starts on last post
-        last_known_id = new_last_id 
-        # last_known_id = new_last_id - 1 # debug
-        write_id(last_known_id) # debug place
-        logger.info(f"Last ID on wall: {last_known_id}")
-    else:
-        last_known_id = read_id()
-        logger.info(f"Last known ID: {last_known_id}")
-
-    if new_last_id > last_known_id:
-        for item in items[::-1]:
-            item: dict
-            if item["id"] <= last_known_id:
-                continue
-            logger.info(f"Working with post with ID: {item['id']}.")
-            if blacklist_check(config.BLACKLIST, item["text"]):
-                continue
-            if whitelist_check(config.WHITELIST, item["text"]):
-                continue
-            if config.SKIP_ADS_POSTS and item["marked_as_ads"]:
-                logger.info("Post was skipped as an advertisement.")
-                continue
-            if config.SKIP_COPYRIGHTED_POST and "copyright" in item:
-                logger.info("Post was skipped as an copyrighted post.")
-                continue
-
-            item_parts = {"post": item}
-            group_name = ""
-            if "copy_history" in item and not config.SKIP_REPOSTS:
-                item_parts["repost"] = item["copy_history"][0]
-                group_name = get_group_name(
-                    config.VK_TOKEN,
-                    config.REQ_VERSION,
-                    abs(item_parts["repost"]["owner_id"]),
-                )
-                logger.info("Detected repost in the post.")
-
-            for item_part in item_parts:
-                prepare_temp_folder()
-                repost_exists: bool = True if len(item_parts) > 1 else False
-
-                logger.info(f"Starting parsing of the {item_part}")
-                parsed_post = parse_post(item_parts[item_part], repost_exists, item_part, group_name)
-                logger.info(f"Starting sending of the {item_part}")
-
-                discord_server = config.DISCORDSERVER_ID
-                
-                executor.start(
-                    dp,
-                    send_post(
-                        bot,
-                        config.TG_CHANNEL,
-                        parsed_post["text"],
-                        parsed_post["photos"],
-                        parsed_post["docs"],
-                        parsed_post["tags"],
-                        config.DISCORDBOT_TOKEN,
-                        discord_server,
-                    ),
-                )
-
-        write_id(new_last_id) # debug place
+def routes_for(community: Community, item: dict, tags: list) -> list:
+    # Маршруты сообщества, которые принимают этот пост по тегам и спискам слов
+    return [route for route in community.destinations if route.accepts(item["text"], tags)]
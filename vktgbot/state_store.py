@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Union
+
+from loguru import logger
+
+from config import STATE_DB, VK_DOMAIN
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cursors (
+    community TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    community TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    part TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message_id INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (community, post_id, part, destination)
+);
+CREATE TABLE IF NOT EXISTS backfills (
+    community TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    processed INTEGER NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS telegram_files (
+    bot_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (bot_id, key)
+);
+"""
+
+LEGACY_LAST_IDS_FILE = "./data/last_ids.json"
+LEGACY_LAST_ID_FILE = "./last_id.txt"
+
+
+class StateStore:
+    # Cursors of all communities and per-post, per-destination delivery status in one SQLite file.
+    # WAL mode: readers never block the writer, so any number of communities share the store.
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._connection: Union[sqlite3.Connection, None] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+            self._migrate_legacy_cursors()
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _migrate_legacy_cursors(self) -> None:
+        # last_ids.json / last_id.txt of older versions are imported once
+        if self._connection.execute("SELECT 1 FROM cursors LIMIT 1").fetchone():
+            return
+        cursors = {}
+        try:
+            with open(LEGACY_LAST_ID_FILE, "r") as file:
+                cursors[VK_DOMAIN] = int(file.read())
+        except (FileNotFoundError, ValueError):
+            pass
+        try:
+            with open(LEGACY_LAST_IDS_FILE, "r") as file:
+                cursors.update(json.load(file))
+        except (FileNotFoundError, ValueError):
+            pass
+        for community, last_id in cursors.items():
+            if community and int(last_id) > 0:
+                self.write_cursor(community, int(last_id))
+                logger.info(f"Imported last ID {last_id} of {community} from the old cursor files.")
+
+    def read_cursor(self, community: str) -> Union[int, None]:
+        row = self.connection.execute("SELECT last_id FROM cursors WHERE community = ?", (community,)).fetchone()
+        return row[0] if row else None
+
+    def write_cursor(self, community: str, last_id: int) -> None:
+        self.connection.execute(
+            "INSERT INTO cursors (community, last_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(community) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at",
+            (community, last_id, time.time()),
+        )
+        logger.info(f"New ID for {community}, written in the state store: {last_id}")
+
+    def get_delivery(self, community: str, post_id: int, part: str, destination: str) -> Union[dict, None]:
+        row = self.connection.execute(
+            "SELECT status, message_id, attempts FROM deliveries "
+            "WHERE community = ? AND post_id = ? AND part = ? AND destination = ?",
+            (community, post_id, part, destination),
+        ).fetchone()
+        return {"status": row[0], "message_id": row[1], "attempts": row[2]} if row else None
+
+    def is_delivered(self, community: str, post_id: int, part: str, destination: str) -> bool:
+        delivery = self.get_delivery(community, post_id, part, destination)
+        return delivery is not None and delivery["status"] == "delivered"
+
+    def mark(
+        self, community: str, post_id: int, part: str, destination: str, status: str, message_id: Union[int, None] = None
+    ) -> None:
+        self.connection.execute(
+            "INSERT INTO deliveries (community, post_id, part, destination, status, message_id, attempts, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT(community, post_id, part, destination) DO UPDATE SET "
+            "status = excluded.status, message_id = COALESCE(excluded.message_id, message_id), "
+            "attempts = attempts + 1, updated_at = excluded.updated_at",
+            (community, post_id, part, destination, status, message_id, time.time()),
+        )
+
+    def failed_posts(self, community: str, max_attempts: int) -> list:
+        # Posts with a destination that failed fewer than max_attempts times, oldest first
+        rows = self.connection.execute(
+            "SELECT DISTINCT post_id FROM deliveries WHERE community = ? AND status = 'failed' AND attempts < ? "
+            "ORDER BY post_id",
+            (community, max_attempts),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_skipped_retries(self, community: str, post_ids: list, since: float) -> None:
+        # A retry that never reached the destination (the post is gone from the wall, filtered out
+        # or not routed there anymore) still counts as an attempt
+        placeholders = ",".join("?" * len(post_ids))
+        self.connection.execute(
+            "UPDATE deliveries SET attempts = attempts + 1, updated_at = ? "
+            f"WHERE community = ? AND status = 'failed' AND updated_at < ? AND post_id IN ({placeholders})",
+            (time.time(), community, since, *post_ids),
+        )
+
+    def read_backfill(self, community: str) -> dict:
+        # Checkpoint of the backfill: last processed ID, wall position of the last finished page
+        # (posts counted from the oldest one) and the number of processed posts
+        row = self.connection.execute(
+            "SELECT last_id, position, processed, finished FROM backfills WHERE community = ?", (community,)
+        ).fetchone()
+        if row is None:
+            return {"last_id": 0, "position": 0, "processed": 0, "finished": False}
+        return {"last_id": row[0], "position": row[1], "processed": row[2], "finished": bool(row[3])}
+
+    def write_backfill(self, community: str, last_id: int, position: int, processed: int, finished: bool = False) -> None:
+        self.connection.execute(
+            "INSERT INTO backfills (community, last_id, position, processed, finished, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(community) DO UPDATE SET last_id = excluded.last_id, position = excluded.position, "
+            "processed = excluded.processed, finished = excluded.finished, updated_at = excluded.updated_at",
+            (community, last_id, position, processed, int(finished), time.time()),
+        )
+
+    def get_file_id(self, bot_id: int, key: str) -> Union[str, None]:
+        row = self.connection.execute(
+            "SELECT file_id FROM telegram_files WHERE bot_id = ? AND key = ?", (bot_id, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_file_id(self, bot_id: int, key: str, file_id: str, size: int) -> None:
+        self.connection.execute(
+            "INSERT INTO telegram_files (bot_id, key, file_id, size, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(bot_id, key) DO UPDATE SET file_id = excluded.file_id, size = excluded.size, "
+            "updated_at = excluded.updated_at",
+            (bot_id, key, file_id, size, time.time()),
+        )
+
+    def delete_file_id(self, bot_id: int, key: str) -> None:
+        self.connection.execute("DELETE FROM telegram_files WHERE bot_id = ? AND key = ?", (bot_id, key))
+
+    def prune(self, older_than: float) -> None:
+        # Delivered posts behind every cursor are not needed to resume anymore,
+        # failed ones are retried on every cycle and are not touched for this long only once given up on
+        self.connection.execute("DELETE FROM deliveries WHERE updated_at < ?", (older_than,))
+
+
+state_store = StateStore(STATE_DB)
@@ -0,0 +1,120 @@
+import re
+
+# Telegram limits count characters after entity parsing: tags are free, &amp; is one character,
+# an emoji outside the BMP is two (UTF-16). Chunks are cut at the best boundary found,
+# open tags are closed at the cut and reopened in the next chunk, so every chunk is valid HTML.
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+ATOM_RE = re.compile(r"<[^>]*>|&#?\w+;|[^\S\n]*\n[\s]*|[^\S\n]+|[^\s<&]+|[<&]")
+TAG_RE = re.compile(r"<(/?)(\w+)")
+SENTENCE_END = ".!?…"
+
+# Break quality: paragraph > line > sentence > word
+PARAGRAPH, LINE, SENTENCE, WORD = 3, 2, 1, 0
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def visible_length(html: str) -> int:
+    return sum(_atom_length(atom) for atom in ATOM_RE.findall(html))
+
+
+def _atom_length(atom: str) -> int:
+    if atom.startswith("<") and len(atom) > 1:
+        return 0
+    if atom.startswith("&") and len(atom) > 1:
+        return 1
+    return utf16_length(atom)
+
+
+def _break_quality(atom: str, previous: str) -> int:
+    if atom.count("\n") >= 2:
+        return PARAGRAPH
+    if "\n" in atom:
+        return LINE
+    if previous and previous[-1] in SENTENCE_END:
+        return SENTENCE
+    return WORD
+
+
+def pack_html(html: str, first_limit: int = MESSAGE_LIMIT, limit: int = MESSAGE_LIMIT) -> list[str]:
+    # first_limit: size of the first chunk (a caption), limit: size of every following one
+    atoms = ATOM_RE.findall(html)
+    chunks = []
+    start = 0
+    reopen: list = []  # tags opened before the chunk starts
+    while start < len(atoms):
+        budget = first_limit if not chunks else limit
+        size = 0
+        stack = list(reopen)
+        best: dict = {}  # quality -> (atom index, size before it, open tags)
+        end = start
+        cut = None
+        while end < len(atoms):
+            atom = atoms[end]
+            length = _atom_length(atom)
+            if atom.isspace():
+                previous = atoms[end - 1] if end > start else ""
+                best[_break_quality(atom, previous)] = (end, size, list(stack))
+            if size + length > budget:
+                cut = _choose_break(best, budget)
+                break
+            size += length
+            tag = TAG_RE.match(atom)
+            if tag:
+                if tag.group(1):
+                    if stack:
+                        stack.pop()
+                else:
+                    stack.append(atom)
+            end += 1
+
+        if cut is None and end < len(atoms):
+            # Ни одного пробела: слово режется посередине
+            head, tail = _split_atom(atoms[end], budget - size)
+            if head:
+                atoms[end : end + 1] = [head, tail]
+                end += 1
+            cut = (end, size, list(stack))
+            skip = 0
+        else:
+            skip = 1  # whitespace at the cut is dropped
+        if cut is None:
+            cut = (len(atoms), size, stack)
+            skip = 0
+
+        index, _, open_tags = cut
+        if index == start and not skip:
+            index += 1  # атом больше целого сообщения, отправляем как есть
+        body = "".join(reopen) + "".join(atoms[start:index])
+        closing = "".join(f"</{TAG_RE.match(tag).group(2)}>" for tag in reversed(open_tags))
+        chunk = (body + closing).strip()
+        if chunk:
+            chunks.append(chunk)
+        start = index + skip
+        reopen = open_tags
+    return chunks
+
+
+def _choose_break(best: dict, budget: int) -> tuple:
+    # The strongest boundary that keeps at least half of the chunk, else the latest one at all
+    for quality in (PARAGRAPH, LINE, SENTENCE, WORD):
+        if quality in best and best[quality][1] >= budget // 2:
+            return best[quality]
+    if best:
+        return max(best.values(), key=lambda candidate: candidate[0])
+    return None
+
+
+def _split_atom(atom: str, budget: int) -> tuple:
+    if len(atom) > 1 and atom[0] in "<&":
+        return "", atom
+    size = 0
+    for position, char in enumerate(atom):
+        size += 2 if ord(char) > 0xFFFF else 1
+        if size > budget:
+            return atom[:position], atom[position:]
+    return atom, ""
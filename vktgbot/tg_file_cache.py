@@ -0,0 +1,91 @@
+import asyncio
+from typing import Union
+
+from aiogram import types
+from loguru import logger
+
+from metrics import telegram_files, upload_bytes_saved
+from state_store import StateStore, state_store
+
+
+class TelegramFileCache:
+    # file_id of every photo and document Telegram has already received, per bot
+    # (a file_id is only valid for the bot that got it). Documents are keyed by the sha256
+    # of their content, photos sent by url by the url. A later send to any chat references
+    # the file_id instead of uploading the file again. Sends of one file to several chats at once
+    # wait for the first upload (acquire/release) instead of uploading in parallel.
+
+    def __init__(self, store: StateStore) -> None:
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_uploaded = 0
+        self._uploads: dict = {}  # (bot_id, key) -> Future, uploads in progress
+
+    def get(self, bot_id: int, key: str, size: int = 0) -> Union[str, None]:
+        file_id = self.store.get_file_id(bot_id, key)
+        if file_id is None:
+            self.misses += 1
+            telegram_files.inc("miss")
+            return None
+        self.hits += 1
+        self.bytes_saved += size
+        telegram_files.inc("hit")
+        upload_bytes_saved.inc(amount=size)
+        return file_id
+
+    async def acquire(self, bot_id: int, key: str, size: int = 0) -> Union[str, None]:
+        # None means the caller uploads the file itself and must call release() afterwards
+        while (bot_id, key) in self._uploads:
+            await asyncio.shield(self._uploads[(bot_id, key)])
+        file_id = self.get(bot_id, key, size)
+        if file_id is None:
+            self._uploads[(bot_id, key)] = asyncio.get_running_loop().create_future()
+        return file_id
+
+    def release(self, bot_id: int, key: str) -> None:
+        upload = self._uploads.pop((bot_id, key), None)
+        if upload is not None and not upload.done():
+            upload.set_result(None)
+
+    def put(self, bot_id: int, key: str, file_id: Union[str, None], size: int = 0) -> None:
+        self.bytes_uploaded += size
+        if file_id:
+            self.store.put_file_id(bot_id, key, file_id, size)
+
+    def forget(self, bot_id: int, key: str) -> None:
+        # Telegram rejected the file_id: the next send uploads the file again
+        logger.warning(f"Telegram file_id of {key} is no longer valid and was removed from the cache.")
+        self.store.delete_file_id(bot_id, key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "bytes_uploaded": self.bytes_uploaded,
+        }
+
+
+def document_key(doc: dict) -> str:
+    return f"sha256:{doc['sha256']}"
+
+
+def photo_key(url: str) -> str:
+    return f"url:{url}"
+
+
+def file_id_of(message: Union[types.Message, None]) -> Union[str, None]:
+    if message is None:
+        return None
+    if message.document:
+        return message.document.file_id
+    if message.photo:
+        return message.photo[-1].file_id
+    return None
+
+
+tg_file_cache = TelegramFileCache(state_store)
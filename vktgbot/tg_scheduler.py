@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from loguru import logger
+
+from config import TG_CHAT_RATE, TG_CHAT_RATE_PER_MINUTE, TG_GLOBAL_RATE
+from metrics import Gauge
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, cost: float) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        return max(self.blocked_until - now, (cost - self.tokens) / self.rate, 0.0)
+
+    def take(self, cost: float) -> None:
+        self.tokens -= min(cost, self.capacity)
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class TelegramScheduler:
+    # Every bot.send_* call goes through here. Token buckets follow Telegram limits:
+    # ~30 messages per second for the bot, 1 per second and 20 per minute for a channel or group.
+    # Messages for one chat leave in order; a flood-wait from Telegram blocks that chat's buckets.
+
+    def __init__(self, global_rate: float, chat_rate_per_minute: float, chat_rate: float = 1) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate_per_minute = chat_rate_per_minute
+        self.chat_rate = chat_rate
+        self.chat_buckets: dict = {}
+        self.chat_locks: dict = {}
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.sends = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _buckets(self, chat_id) -> list:
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = [
+                TokenBucket(self.chat_rate, max(1, self.chat_rate)),
+                TokenBucket(self.chat_rate_per_minute / 60, self.chat_rate_per_minute),
+            ]
+            self.chat_locks[chat_id] = asyncio.Lock()
+        return [self.global_bucket] + self.chat_buckets[chat_id]
+
+    async def send(self, chat_id, method, *args, cost: int = 1, **kwargs):
+        # cost: number of messages the call produces (a media group counts every item)
+        buckets = self._buckets(chat_id)
+        enqueued = time.monotonic()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            async with self.chat_locks[chat_id]:
+                while True:
+                    delay = max(bucket.delay_for(cost) for bucket in buckets)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                for bucket in buckets:
+                    bucket.take(cost)
+        finally:
+            self.queue_depth -= 1
+
+        wait = time.monotonic() - enqueued
+        self.sends += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait >= 1:
+            logger.info(f"Telegram message to {chat_id} waited {wait:.2f}s in the queue ({self.queue_depth} still queued).")
+        return await method(*args, **kwargs)
+
+    def flood_wait(self, chat_id, seconds: float) -> None:
+        for bucket in self._buckets(chat_id)[1:]:
+            bucket.block(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "sends": self.sends,
+            "avg_wait": round(self.total_wait / self.sends, 3) if self.sends else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+
+tg_scheduler = TelegramScheduler(TG_GLOBAL_RATE, TG_CHAT_RATE_PER_MINUTE, TG_CHAT_RATE)
+Gauge("vktgbot_telegram_queue_depth", "Telegram messages waiting for their turn.", lambda: tg_scheduler.queue_depth)
@@ -0,0 +1,112 @@
+import json
+from collections import OrderedDict
+
+from loguru import logger
+
+from api_requests import execute_vk_code
+from attachments import VideoRef
+
+EXECUTE_CALLS_LIMIT = 25  # API calls allowed inside one "execute"
+VIDEOS_PER_CALL = 200
+GROUPS_PER_CALL = 500
+
+
+class LRUCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key, value) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class VkResolver:
+    # Resolves video urls and repost group names for a whole fetch cycle
+    # with as few VK requests as possible (one "execute" per 25 batched calls).
+
+    def __init__(self, vk_token: str, req_version: float, group_cache_size: int = 1000) -> None:
+        self.vk_token = vk_token
+        self.req_version = req_version
+        self.group_names = LRUCache(group_cache_size)
+
+    async def resolve(self, parsed_posts: list) -> dict:
+        # parsed_posts: ParsedPost of every post and repost part of the cycle
+        video_keys: dict = {}
+        group_ids: set = set()
+        for parsed in parsed_posts:
+            if parsed.repost_owner_id < 0:
+                group_ids.add(-parsed.repost_owner_id)
+            for handle in parsed.attachments:
+                if isinstance(handle, VideoRef):
+                    video_keys[handle.key] = handle.access_key
+
+        if not video_keys and not group_ids:
+            return {}
+
+        missing_groups = [group_id for group_id in group_ids if group_id not in self.group_names]
+        calls = [
+            ("video", keys)
+            for keys in chunks(
+                [f"{key}_{access_key}" if access_key else key for key, access_key in video_keys.items()],
+                VIDEOS_PER_CALL,
+            )
+        ] + [("group", ids) for ids in chunks([str(group_id) for group_id in missing_groups], GROUPS_PER_CALL)]
+
+        video_urls: dict = {}
+        for batch in chunks(calls, EXECUTE_CALLS_LIMIT):
+            results = await execute_vk_code(self.vk_token, self.req_version, build_execute_code(batch))
+            if not isinstance(results, list):
+                continue
+            for (kind, _), result in zip(batch, results):
+                if not result:
+                    continue
+                if kind == "video":
+                    for video in result.get("items", []):
+                        video_urls[video_key(video)] = video.get("files", {}).get("external", "")
+                else:
+                    # Since API 5.194 groups.getById returns {"groups": [...]}
+                    for group in result.get("groups", []) if isinstance(result, dict) else result:
+                        self.group_names.set(group["id"], group["name"])
+
+        logger.info(
+            f"Resolved {len(video_urls)}/{len(video_keys)} videos and {len(group_ids)} group names "
+            f"({len(group_ids) - len(missing_groups)} from cache) in {len(chunks(calls, EXECUTE_CALLS_LIMIT))} VK requests."
+        )
+        return video_urls
+
+    def group_name(self, owner_id: int) -> str:
+        return self.group_names.get(-owner_id, "") if owner_id < 0 else ""
+
+
+def video_key(video: dict) -> str:
+    return f"{video['owner_id']}_{video['id']}"
+
+
+def chunks(values: list, size: int) -> list:
+    return [values[i : i + size] for i in range(0, len(values), size)]
+
+
+def build_execute_code(batch: list) -> str:
+    calls = []
+    for kind, values in batch:
+        if kind == "video":
+            calls.append(f'API.video.get({{"videos": {json.dumps(",".join(values))}}})')
+        else:
+            calls.append(f'API.groups.getById({{"group_ids": {json.dumps(",".join(values))}}})')
+    return f"return [{', '.join(calls)}];"
+
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import time
+from typing import Union
+
+import discord
+from loguru import logger
+
+
+class WebhookDirectory:
+    # tag -> {'channel_id': ..., 'url': ...} for one Discord server.
+    # Built once, kept on disk and refreshed in the background every `ttl` seconds,
+    # so sending a post is a plain dict lookup instead of a REST call per channel.
+
+    def __init__(self, path: str, server_id: int, ttl: int) -> None:
+        self.path = path
+        self.server_id = server_id
+        self.ttl = ttl
+        self.webhooks: dict = {}
+        self.updated_at: float = 0.0
+        self._refresh_task: Union[asyncio.Task, None] = None
+        self.load()
+
+    @property
+    def is_stale(self) -> bool:
+        return not self.webhooks or time.time() - self.updated_at >= self.ttl
+
+    def get(self, tag: str) -> Union[dict, None]:
+        return self.webhooks.get(tag)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.webhooks
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            logger.warning(f"Webhook directory {self.path} is unreadable and will be rebuilt: {e}")
+            return
+
+        if data.get("server_id") != self.server_id:
+            logger.info(f"Webhook directory {self.path} belongs to another server, it will be rebuilt.")
+            return
+        self.webhooks = data.get("webhooks", {})
+        self.updated_at = data.get("updated_at", 0.0)
+        logger.info(f"Loaded {len(self.webhooks)} webhooks from {self.path}.")
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"server_id": self.server_id, "updated_at": self.updated_at, "webhooks": self.webhooks},
+                file,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.path)
+
+    def invalidate_url(self, url: str) -> None:
+        # Webhook was deleted or its token was reset: drop only this entry.
+        tags = [tag for tag, webhook in self.webhooks.items() if webhook["url"] == url]
+        if not tags:
+            return
+        self.webhooks = {tag: webhook for tag, webhook in self.webhooks.items() if webhook["url"] != url}
+        self.save()
+        logger.warning(f"Webhook for {', '.join(tags)} is no longer valid and was removed from the directory.")
+
+    async def refresh(self, discord_bot) -> None:
+        webhooks = await scan_webhooks(discord_bot, self.server_id)
+        if webhooks is None:
+            return
+        self.webhooks = webhooks
+        self.updated_at = time.time()
+        self.save()
+        logger.info(f"Webhook directory refreshed: {len(webhooks)} webhooks.")
+
+    async def ensure(self, discord_bot) -> None:
+        if not self.webhooks:
+            await self.refresh(discord_bot)
+
+    def start_background_refresh(self, discord_bot) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_forever(discord_bot))
+
+    async def _refresh_forever(self, discord_bot) -> None:
+        while True:
+            await asyncio.sleep(max(0.0, self.updated_at + self.ttl - time.time()))
+            try:
+                await self.refresh(discord_bot)
+            except Exception as e:
+                logger.warning(f"Webhook directory refresh failed: {e}")
+            if self.is_stale:
+                logger.warning("Webhook directory is still empty or outdated. Retry in 60 seconds.")
+                await asyncio.sleep(60)
+
+
+async def scan_webhooks(discord_bot, server_id: int) -> Union[dict, None]:
+    guild = discord_bot.get_guild(server_id)
+    if guild is None:
+        logger.error(f"Discord server {server_id} is not available for the bot.")
+        return None
+
+    webhooks_dict = {}
+    for channel in guild.text_channels:
+        try:
+            webhooks = await channel.webhooks()
+            for webhook in webhooks:
+                webhooks_dict[webhook.name] = {"channel_id": channel.id, "url": webhook.url}
+        except discord.Forbidden:
+            logger.warning(f"Нет доступа к вебхукам канала {channel.name}")
+        except Exception as e:
+            logger.error(f"Ошибка при получении вебхуков для канала {channel.name}: {e}")
+    logger.info(f"Сервер: {guild.name} (ID: {guild.id}), Словарь вебхуков: {webhooks_dict}")
+    return webhooks_dict